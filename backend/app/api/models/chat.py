@@ -1,17 +1,27 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from beanie import Document, Link
-from pydantic import Field
-import uuid
+from pydantic import BaseModel, Field
+from app.config import settings
+import pymongo
+import ulid
 
 class Source(Document):
     """Model for source documents referenced in messages."""
     text: str = Field(...)
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
+# Prompt prefixes for each message role; anything other than a user message is the assistant
+HISTORY_ROLE_LABELS = {"user": "User: ", "assistant": "Assistant: "}
+
+class MessageHistoryProjection(BaseModel):
+    """Projection of the message fields needed to format chat history."""
+    role: str
+    content: str
+
 class Message(Document):
     """Model for individual chat messages."""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: ulid.new().str)
     chat_id: str = Field(...)
     role: str = Field(...)  # 'user' or 'assistant'
     content: str = Field(...)
@@ -21,10 +31,40 @@ class Message(Document):
     
     class Settings:
         name = "messages"
+        indexes = [
+            [("chat_id", pymongo.ASCENDING), ("timestamp", pymongo.ASCENDING)],
+        ]
+
+    @classmethod
+    async def format_history(
+        cls,
+        chat_id: str,
+        limit: int = settings.MAX_HISTORY_TURNS,
+        max_tokens: int = settings.MAX_HISTORY_TOKENS
+    ) -> Optional[str]:
+        """
+        Format the most recent messages of a chat as prompt-ready conversation history, keeping
+        only the newest whole messages that fit in max_tokens (the latest one is always kept).
+        """
+        messages = await cls.find(
+            {"chat_id": chat_id}, projection_model=MessageHistoryProjection
+        ).sort("-timestamp").limit(limit).to_list()
+        if not messages:
+            return None
+
+        kept = []
+        budget = max_tokens
+        for msg in messages:
+            tokens = len(msg.content.split()) * 1.3  # Rough token estimate
+            if tokens > budget and kept:
+                break
+            kept.append(HISTORY_ROLE_LABELS.get(msg.role, "Assistant: ") + msg.content)
+            budget -= tokens
+        return "\n\n".join(reversed(kept))
         
 class SessionMetadata(Document):
     """Model for storing session metadata."""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: ulid.new().str)
     chat_id: str = Field(...)
     user_id: Optional[str] = Field(default=None)
     user_agent: Optional[str] = Field(default=None)
@@ -35,9 +75,19 @@ class SessionMetadata(Document):
     class Settings:
         name = "session_metadata"
 
+class ChatListProjection(BaseModel):
+    """Projection of the chat fields needed for chat list responses."""
+    id: str = Field(alias="_id")
+    title: str
+    document_id: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    preview: str = ""
+
 class Chat(Document):
     """Model for chat conversations."""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: ulid.new().str)
     title: str = Field(...)
     document_id: Optional[str] = Field(default=None)  # If associated with a specific document
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -49,6 +99,12 @@ class Chat(Document):
     
     class Settings:
         name = "chats"
+        indexes = [
+            # The unfiltered chat list: {"deleted": False} sorted by -updated_at
+            [("deleted", pymongo.ASCENDING), ("updated_at", pymongo.DESCENDING)],
+            [("deleted", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING), ("updated_at", pymongo.DESCENDING)],
+            [("deleted", pymongo.ASCENDING), ("document_id", pymongo.ASCENDING), ("updated_at", pymongo.DESCENDING)],
+        ]
     
     @classmethod
     async def get_active_chats(cls, user_id: Optional[str] = None, document_id: Optional[str] = None):
@@ -61,17 +117,32 @@ class Chat(Document):
         if document_id:
             query["document_id"] = document_id
             
-        return await cls.find(query).sort("-updated_at").to_list()
+        return await cls.find(query, projection_model=ChatListProjection).sort("-updated_at").to_list()
     
     @classmethod
     async def get_chat_with_messages(cls, chat_id: str):
-        """Get a chat and all its messages."""
-        chat = await cls.get(chat_id)
-        if not chat:
+        """Get a chat and all its messages in a single aggregation round trip."""
+        pipeline = [
+            # By id only, like Chat.get: soft-deleted chats stay fetchable
+            {"$match": {"_id": chat_id}},
+            {"$lookup": {
+                "from": Message.Settings.name,
+                "localField": "_id",
+                "foreignField": "chat_id",
+                "as": "messages",
+                "pipeline": [{"$sort": {"timestamp": 1}}]
+            }}
+        ]
+        results = await cls.aggregate(pipeline).to_list(length=1)
+        if not results:
             return None
-            
-        messages = await Message.find({"chat_id": chat_id}).sort("+timestamp").to_list()
+
+        chat_doc = results[0]
+        message_docs = chat_doc.pop("messages", [])
         return {
-            "chat": chat,
-            "messages": messages
+            "chat": cls.model_construct(id=chat_doc.pop("_id"), **chat_doc),
+            "messages": [
+                Message.model_construct(id=message_doc.pop("_id"), **message_doc)
+                for message_doc in message_docs
+            ]
         }
\ No newline at end of file
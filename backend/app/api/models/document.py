@@ -1,5 +1,6 @@
 from typing import List, Dict, Any, Optional
-from pydantic import BaseModel, Field
+from beanie import Document
+from pydantic import BaseModel, ConfigDict, Field
 
 class DocumentBase(BaseModel):
     """Base model for document information."""
@@ -12,6 +13,8 @@ class DocumentCreate(DocumentBase):
 
 class DocumentResponse(DocumentBase):
     """Model for document response with summary and metadata."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     id: str
     summary: str
     metadata: Dict[str, Any]
@@ -19,6 +22,8 @@ class DocumentResponse(DocumentBase):
 
 class DocumentListResponse(BaseModel):
     """Model for listing multiple documents."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     documents: List[DocumentResponse]
 
 class DocumentListUploadResponse(BaseModel):
@@ -28,5 +33,22 @@ class DocumentListUploadResponse(BaseModel):
 
 class DocumentSummaryResponse(BaseModel):
     """Model for document summary response."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     document_id: str
-    summary: str
\ No newline at end of file
+    summary: str
+
+class DocumentRecord(Document):
+    """Model for persisted document metadata and processing status."""
+    id: str = Field(...)
+    filename: str = Field(...)
+    path: str = Field(...)
+    storage_type: str = Field(...)  # 'local' or 's3'
+    type: str = Field(...)
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+    summary: str = Field(default="")
+    status: str = Field(default="processing")
+    error_message: Optional[str] = Field(default=None)
+
+    class Settings:
+        name = "documents"
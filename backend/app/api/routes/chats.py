@@ -1,9 +1,12 @@
+import asyncio
+import ulid
 from datetime import datetime
-from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, HTTPException, Depends, Request
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Union
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from pymongo import ReturnDocument
 
-from app.api.models.chat import Chat, Message
+from app.api.models.chat import Chat, ChatListProjection, Message
 
 router = APIRouter()
 
@@ -20,6 +23,8 @@ class MessageUpdateRequest(BaseModel):
 
 class MessageResponse(BaseModel):
     """Model for message response."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     id: str
     role: str
     content: str
@@ -38,6 +43,8 @@ class ChatUpdate(BaseModel):
 
 class ChatResponse(BaseModel):
     """Model for chat response."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     id: str
     title: str
     document_id: Optional[str] = None
@@ -48,17 +55,57 @@ class ChatResponse(BaseModel):
 
 class ChatWithMessagesResponse(BaseModel):
     """Model for chat with messages response."""
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     chat: ChatResponse
     messages: List[MessageResponse]
 
+# Serializers for list responses, built once at import
+_chats_adapter = TypeAdapter(List[ChatResponse])
+_messages_adapter = TypeAdapter(List[MessageResponse])
+
+def _make_preview(content: str) -> str:
+    """Truncate message content to the 100-character chat preview."""
+    return content if len(content) <= 100 else f"{content[:97]}..."
+
+def _chat_response(chat: Union[Chat, ChatListProjection]) -> ChatResponse:
+    """Build a ChatResponse from a trusted Chat document without re-validating it."""
+    return ChatResponse.model_construct(
+        id=str(chat.id),
+        title=chat.title,
+        document_id=chat.document_id,
+        created_at=chat.created_at,
+        updated_at=chat.updated_at,
+        message_count=chat.message_count,
+        preview=chat.preview
+    )
+
+def _json_response(content: bytes) -> Response:
+    """Wrap already-serialized JSON; a returned Response skips FastAPI's response_model re-validation."""
+    return Response(content=content, media_type="application/json")
+
+def _message_response(message: Message) -> MessageResponse:
+    """Build a MessageResponse from a trusted Message document without re-validating it."""
+    return MessageResponse.model_construct(
+        id=str(message.id),
+        role=message.role,
+        content=message.content,
+        timestamp=message.timestamp,
+        sources=message.sources,
+        updated_at=message.updated_at
+    )
+
 @router.post("/", response_model=ChatResponse)
 async def create_chat(chat_data: ChatCreate, request: Request):
     """Create a new chat."""
     try:
         # Create new chat
+        now = datetime.utcnow()
         chat = Chat(
             title=chat_data.title,
             document_id=chat_data.document_id,
+            created_at=now,
+            updated_at=now,
             preview="No messages yet"
         )
         await chat.insert()
@@ -68,44 +115,51 @@ async def create_chat(chat_data: ChatCreate, request: Request):
         raise HTTPException(status_code=500, detail=f"Failed to create chat: {str(e)}")
 
 @router.get("/", response_model=List[ChatResponse])
-async def get_chats(document_id: Optional[str] = None):
+async def get_chats(document_id: Optional[str] = None) -> Response:
     """Get all active chats, optionally filtered by document_id."""
     try:
         chats = await Chat.get_active_chats(document_id=document_id)
-        return chats
+        # Serialize straight to JSON bytes, skipping jsonable_encoder
+        return _json_response(_chats_adapter.dump_json([_chat_response(chat) for chat in chats]))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve chats: {str(e)}")
 
 @router.get("/{chat_id}", response_model=ChatWithMessagesResponse)
-async def get_chat(chat_id: str):
+async def get_chat(chat_id: str) -> Response:
     """Get a chat by ID with its messages."""
     try:
         result = await Chat.get_chat_with_messages(chat_id)
-        # print(result)
         if not result:
             raise HTTPException(status_code=404, detail="Chat not found")
-        return result
+        return _json_response(ChatWithMessagesResponse.model_construct(
+            chat=_chat_response(result["chat"]),
+            messages=[_message_response(message) for message in result["messages"]]
+        ).model_dump_json())
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve chat: {str(e)}")
 
 @router.put("/{chat_id}", response_model=ChatResponse)
-async def update_chat(chat_id: str, chat_data: ChatUpdate):
+async def update_chat(chat_id: str, chat_data: ChatUpdate) -> Response:
     """Update a chat."""
     try:
-        chat = await Chat.get(chat_id)
-        if not chat:
-            raise HTTPException(status_code=404, detail="Chat not found")
-        
         update_data = {}
         if chat_data.title is not None:
             update_data["title"] = chat_data.title
         
         update_data["updated_at"] = datetime.utcnow()
         
-        await chat.update({"$set": update_data})
-        return await Chat.get(chat_id)
+        # Update and fetch the new state atomically in one round trip
+        updated = await Chat.get_motor_collection().find_one_and_update(
+            {"_id": chat_id},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        
+        return _json_response(_chat_response(Chat.model_construct(id=updated.pop("_id"), **updated)).model_dump_json())
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -129,43 +183,43 @@ async def delete_chat(chat_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to delete chat: {str(e)}")
 
 @router.post("/{chat_id}/messages", response_model=MessageResponse)
-async def add_message(chat_id: str, message_data: MessageCreate):
+async def add_message(chat_id: str, message_data: MessageCreate) -> Response:
     """Add a message to a chat."""
     try:
-        chat = await Chat.get(chat_id)
-        if not chat:
-            raise HTTPException(status_code=404, detail="Chat not found")
+        # Update chat; only assistant messages replace the preview
+        chat_update = {"updated_at": datetime.utcnow()}
+        if message_data.role == "assistant":
+            chat_update["preview"] = _make_preview(message_data.content)
         
-        # Create message
-        message = Message(
-            chat_id=chat_id,
-            role=message_data.role,
-            content=message_data.content,
-            sources=message_data.sources or []
-        )
-        await message.insert()
+        message_doc = {
+            "_id": ulid.new().str,
+            "chat_id": chat_id,
+            "role": message_data.role,
+            "content": message_data.content,
+            "timestamp": chat_update["updated_at"],
+            "sources": message_data.sources or [],
+            "updated_at": None
+        }
         
-        # Update chat
-        preview = message_data.content
-        if len(preview) > 100:
-            preview = preview[:97] + "..."
-            
-        await chat.update({
-            "$set": {
-                "updated_at": datetime.utcnow(),
-                "preview": preview if message_data.role == "assistant" else chat.preview
-            },
-            "$inc": {"message_count": 1}
-        })
+        # Bump the chat first, so a message is only ever inserted for a chat that exists
+        result = await Chat.get_motor_collection().update_one(
+            {"_id": chat_id},
+            {"$set": chat_update, "$inc": {"message_count": 1}}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        await Message.get_motor_collection().insert_one(message_doc)
         
-        return message
+        return _json_response(
+            _message_response(Message.model_construct(id=message_doc.pop("_id"), **message_doc)).model_dump_json()
+        )
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to add message: {str(e)}")
 
 @router.get("/{chat_id}/messages", response_model=List[MessageResponse])
-async def get_messages(chat_id: str):
+async def get_messages(chat_id: str) -> Response:
     """Get all messages for a chat."""
     try:
         chat = await Chat.get(chat_id)
@@ -173,7 +227,7 @@ async def get_messages(chat_id: str):
             raise HTTPException(status_code=404, detail="Chat not found")
         
         messages = await Message.find({"chat_id": chat_id}).sort("timestamp", 1).to_list()
-        return messages
+        return _json_response(_messages_adapter.dump_json([_message_response(message) for message in messages]))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -184,55 +238,47 @@ async def update_message(
     chat_id: str,
     message_id: str,
     message_update: MessageUpdateRequest
-):
+) -> Response:
     """
     Update an existing message in a chat.
     Used for regenerating answers without creating new messages.
     """
     try:
-        # Find the message
-        message = await Message.get(message_id)
-        
-        if not message or str(message.chat_id) != chat_id:
-            raise HTTPException(status_code=404, detail="Message not found")
+        now = datetime.utcnow()
         
         # Update data
         update_data = {
             "content": message_update.content,
-            "updated_at": datetime.utcnow()
+            "updated_at": now
         }
         
         if message_update.sources is not None:
             update_data["sources"] = message_update.sources
         
-        # Update the message
-        await message.update({"$set": update_data})
+        # Update the message and fetch its new state in one round trip
+        updated = await Message.get_motor_collection().find_one_and_update(
+            {"_id": message_id, "chat_id": chat_id},
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            raise HTTPException(status_code=404, detail="Message not found")
         
-        # Get updated message
-        updated_message = await Message.get(message_id)
+        updated_message = Message.model_construct(id=updated.pop("_id"), **updated)
         
         # Update chat preview if it's an assistant message
         if updated_message.role == "assistant":
-            preview = updated_message.content
-            if len(preview) > 100:
-                preview = preview[:97] + "..."
+            preview = _make_preview(updated_message.content)
             
-            chat = await Chat.get(chat_id)
-            await chat.update({
-                "$set": {
-                    "updated_at": datetime.utcnow(),
+            await Chat.get_motor_collection().update_one(
+                {"_id": chat_id},
+                {"$set": {
+                    "updated_at": now,
                     "preview": preview
-                }
-            })
+                }}
+            )
         
-        return MessageResponse(
-            id=str(updated_message.id),
-            role=updated_message.role,
-            content=updated_message.content,
-            timestamp=updated_message.timestamp,
-            sources=updated_message.sources,
-            updated_at=updated_message.updated_at
-        )
+        return _json_response(_message_response(updated_message).model_dump_json())
         
     except HTTPException as e:
         raise e
@@ -243,22 +289,21 @@ async def update_message(
 async def clear_messages(chat_id: str):
     """Delete all messages in a chat."""
     try:
-        chat = await Chat.get(chat_id)
-        if not chat:
+        # Delete all messages and reset chat metadata concurrently
+        _, chat_result = await asyncio.gather(
+            Message.get_motor_collection().delete_many({"chat_id": chat_id}),
+            Chat.get_motor_collection().update_one(
+                {"_id": chat_id},
+                {"$set": {
+                    "updated_at": datetime.utcnow(),
+                    "message_count": 0,
+                    "preview": "No messages yet"
+                }}
+            )
+        )
+        if chat_result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Chat not found")
         
-        # Delete all messages
-        await Message.find({"chat_id": chat_id}).delete_many()
-        
-        # Update chat metadata
-        await chat.update({
-            "$set": {
-                "updated_at": datetime.utcnow(),
-                "message_count": 0,
-                "preview": "No messages yet"
-            }
-        })
-        
         return {"message": f"All messages in chat {chat_id} deleted successfully"}
     except HTTPException as e:
         raise e
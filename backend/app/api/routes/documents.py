@@ -1,11 +1,12 @@
 from asyncio.log import logger
+import asyncio
 import os
 import shutil
 import tempfile
 import uuid
-from typing import List, Dict, Any
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import JSONResponse
+from typing import BinaryIO, List, Dict, Any, Optional, Tuple
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks, Query, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 import uuid
 
@@ -14,165 +15,231 @@ from app.core.document_processor import DocumentProcessor
 from app.core.azure_search import AzureSearchService
 from app.core.qa_chain import QAService
 from app.core.s3_storage import S3StorageService
-from app.api.models.document import DocumentResponse, DocumentListResponse, DocumentListUploadResponse
+from app.dependencies import get_document_processor, get_azure_search_service, get_qa_service, get_s3_storage_service
+from app.api.models.document import DocumentResponse, DocumentListResponse, DocumentListUploadResponse, DocumentRecord
+from app.utils.helpers import LRUCache
 
 router = APIRouter()
 
-# Create instances of required services
-document_processor = DocumentProcessor()
-azure_search_service = AzureSearchService()
-qa_service = QAService()
-
-# Initialize S3 storage service if enabled
-s3_storage = S3StorageService() if settings.USE_S3_STORAGE else None
-
-# In-memory document storage (in a real app, use a database)
-documents_db = {}
-
 class DocumentListUploadResponse(BaseModel):
     documents: List[DocumentResponse]
     failed_uploads: List[Dict[str, str]] = []
     
-    
+# Streamed uploads stay in memory up to this size before spilling to disk
+STREAM_SPOOL_MAX_SIZE = 1024 * 1024
+
+# Per-process, size-bounded cache of list responses for ready documents, whose summary,
+# metadata and status no longer change
+_document_responses = LRUCache(maxsize=settings.MAX_DOCUMENTS_IN_MEMORY)
+
+def _document_response(doc: DocumentRecord) -> DocumentResponse:
+    """Build a DocumentResponse from a trusted DocumentRecord without re-validating it."""
+    return DocumentResponse.model_construct(
+        id=doc.id,
+        filename=doc.filename,
+        type=doc.type,
+        summary=doc.summary,
+        metadata=doc.metadata,
+        status=doc.status
+    )
+
+def _save_upload(file_obj: BinaryIO, file_path: str) -> None:
+    """Copy an uploaded file to local storage."""
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file_obj, buffer)
+
+def _remove_local_file(file_path: str) -> None:
+    """Remove a locally stored file if it exists."""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def _remove_s3_object(s3_storage: S3StorageService, s3_key: str) -> None:
+    """Remove an S3 object if it exists."""
+    # Deleting a missing key succeeds, so no existence check round trip is needed
+    s3_storage.delete_file(s3_key)
 
 @router.get("/{document_id}/status")
 async def get_document_status(document_id: str):
     """Get the processing status of a document."""
-    if document_id not in documents_db:
+    doc = await DocumentRecord.get(document_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    doc = documents_db[document_id]
     return {
         "document_id": document_id,
-        "status": doc.get("status", "unknown"),
-        "error_message": doc.get("error_message", None)
+        "status": doc.status or "unknown",
+        "error_message": doc.error_message
     }
 
-async def update_document_status(document_id: str, chunks: List[Dict[str, Any]]):
-    """Background task to upload chunks and update document status."""
+async def process_document_job(
+    document_id: str,
+    file_path: str,
+    document_processor: DocumentProcessor,
+    azure_search_service: AzureSearchService,
+    s3_storage: Optional[S3StorageService]
+):
+    """Background task to process a stored document, index its chunks and update its status."""
+    download_dir = None
     try:
+        # Open the stored file off the event loop; PDF chunks are extracted lazily while uploading
+        if settings.USE_S3_STORAGE:
+            # Download straight to disk, so the file never sits in memory as bytes and
+            # extraction workers reopen it by path instead of receiving a pickled copy
+            download_dir = tempfile.mkdtemp()
+            local_path = os.path.join(download_dir, os.path.basename(file_path))
+            await asyncio.to_thread(s3_storage.download_file, file_path, local_path)
+            chunks, metadata = await asyncio.to_thread(
+                document_processor.stream_file, local_path, None, document_id
+            )
+        else:
+            chunks, metadata = await asyncio.to_thread(
+                document_processor.stream_file, file_path, None, document_id
+            )
+        
+        # Add storage info to metadata
+        metadata["storage_type"] = "s3" if settings.USE_S3_STORAGE else "local"
+        metadata["storage_path"] = file_path
+        
+        # Generate document summary (built from metadata alone, so the chunk stream is not consumed)
+        summary = await asyncio.to_thread(document_processor.summarize_document, [], metadata)
+        
+        await DocumentRecord.find_one({"_id": document_id}).update({
+            "$set": {"type": metadata["type"], "metadata": metadata, "summary": summary, "status": "processing"}
+        })
+        
         # Upload chunks to Azure Search
         await azure_search_service.upload_chunks(chunks)
         
         # Update document status to ready
-        if document_id in documents_db:
-            documents_db[document_id]["status"] = "ready"
-            logger.info(f"Document {document_id} processing completed.")
+        await DocumentRecord.find_one({"_id": document_id}).update({"$set": {"status": "ready"}})
+        logger.info(f"Document {document_id} processing completed.")
     except Exception as e:
-        # Set status to error if upload fails
-        if document_id in documents_db:
-            documents_db[document_id]["status"] = "error"
-            documents_db[document_id]["error_message"] = str(e)
+        # Set status to error if processing or upload fails
+        await DocumentRecord.find_one({"_id": document_id}).update({
+            "$set": {"status": "error", "error_message": str(e)}
+        })
         logger.error(f"Error processing document {document_id}: {str(e)}")
+    finally:
+        if download_dir:
+            # Chunks are extracted lazily, so the download is only removed once they are uploaded
+            await asyncio.to_thread(shutil.rmtree, download_dir, True)
+
+async def _store_and_queue_document(
+    background_tasks: BackgroundTasks,
+    file_obj: BinaryIO,
+    filename: str,
+    file_ext: str,
+    document_processor: DocumentProcessor,
+    azure_search_service: AzureSearchService,
+    s3_storage: Optional[S3StorageService]
+) -> DocumentResponse:
+    """Store an uploaded file, register its DocumentRecord and queue it for processing."""
+    # Generate a unique filename
+    unique_id = str(uuid.uuid4())
+    unique_filename = f"{unique_id}{file_ext}"
+    
+    s3_key = ""
+    
+    try:
+        if settings.USE_S3_STORAGE:
+            # Stream the upload straight to S3
+            s3_key = s3_storage.get_s3_key(unique_filename)
+            await asyncio.to_thread(s3_storage.upload_fileobj, file_obj, s3_key)
+            file_path = s3_key
+        else:
+            # Save to local file system
+            file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
+            await asyncio.to_thread(_save_upload, file_obj, file_path)
+        
+        metadata = {
+            "storage_type": "s3" if settings.USE_S3_STORAGE else "local",
+            "storage_path": file_path
+        }
+        
+        # Store document metadata
+        await DocumentRecord(
+            id=unique_id,
+            filename=filename,
+            path=file_path,
+            storage_type=metadata["storage_type"],
+            type=file_ext[1:],
+            metadata=metadata,
+            status="queued"
+        ).insert()
+    except Exception:
+        # Clean up the file if it was saved
+        if settings.USE_S3_STORAGE:
+            if s3_key:
+                await asyncio.to_thread(_remove_s3_object, s3_storage, s3_key)
+        else:
+            await asyncio.to_thread(_remove_local_file, os.path.join(settings.UPLOAD_DIR, unique_filename))
+        raise
+    
+    # Process and index the document (in background)
+    background_tasks.add_task(
+        process_document_job, unique_id, file_path,
+        document_processor, azure_search_service, s3_storage
+    )
+    
+    return DocumentResponse(
+        id=unique_id,
+        filename=filename,
+        type=file_ext[1:],
+        summary="",
+        metadata=metadata,
+        status="queued"
+    )
 
 @router.post("/upload", response_model=DocumentListUploadResponse)
 async def upload_documents(
     background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    azure_search_service: AzureSearchService = Depends(get_azure_search_service),
+    s3_storage: Optional[S3StorageService] = Depends(get_s3_storage_service),
 ):
     """
     Upload multiple documents (PDF or CSV) for processing and indexing.
+    Files are stored and queued; parsing, summarization and indexing run in the background.
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
     
-    processed_documents = []
-    failed_uploads = []
+    upload_semaphore = asyncio.Semaphore(settings.MAX_UPLOAD_CONCURRENCY)
     
-    for file in files:
+    async def handle_one(file: UploadFile) -> Tuple[Optional[DocumentResponse], Optional[Dict[str, str]]]:
+        """Store and register a single uploaded file, queueing it for processing."""
         # Check file extension
         file_ext = os.path.splitext(file.filename)[1].lower()
         if file_ext not in ['.pdf', '.csv']:
-            failed_uploads.append({
+            return None, {
                 "filename": file.filename,
                 "reason": "Unsupported file type. Only PDF and CSV files are supported"
-            })
-            continue
-        
-        # Generate a unique filename
-        unique_id = str(uuid.uuid4())
-        unique_filename = f"{unique_id}{file_ext}"
-        
-        # Temporary file for processing
-        temp_file_path = ""
-        s3_key = ""
-        
-        try:
-            if settings.USE_S3_STORAGE:
-                # Create a temporary file to save the upload
-                with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-                    temp_file_path = temp_file.name
-                    shutil.copyfileobj(file.file, temp_file)
-                
-                # Upload to S3
-                s3_key = s3_storage.get_s3_key(unique_filename)
-                s3_storage.upload_file(temp_file_path, s3_key)
-                file_path = s3_key  # Pass S3 key as file path for metadata
-            else:
-                # Save to local file system
-                file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-            
-            # Process document
-            chunks, metadata = document_processor.process_file(temp_file_path if settings.USE_S3_STORAGE else file_path)
-            
-            # Add storage info to metadata
-            metadata["storage_type"] = "s3" if settings.USE_S3_STORAGE else "local"
-            metadata["storage_path"] = s3_key if settings.USE_S3_STORAGE else file_path
-            
-            # Generate document summary
-            summary = document_processor.summarize_document(chunks, metadata)
-            
-            # Store document metadata
-            document_id = metadata["id"]
-            documents_db[document_id] = {
-                "id": document_id,
-                "filename": file.filename,
-                "path": s3_key if settings.USE_S3_STORAGE else file_path,
-                "storage_type": "s3" if settings.USE_S3_STORAGE else "local",
-                "type": metadata["type"],
-                "metadata": metadata,
-                "summary": summary,
-                "status": "processing"
             }
-            
-            # Upload chunks to Azure Search (in background)
-            background_tasks.add_task(update_document_status, document_id, chunks)
-            
-            # Add to processed documents list
-            processed_documents.append(
-                DocumentResponse(
-                    id=document_id,
-                    filename=file.filename,
-                    type=metadata["type"],
-                    summary=summary,
-                    metadata=metadata,
-                    status="processing" 
+        
+        async with upload_semaphore:
+            try:
+                document = await _store_and_queue_document(
+                    background_tasks, file.file, file.filename, file_ext,
+                    document_processor, azure_search_service, s3_storage
                 )
-            )
-            
-        except Exception as e:
-            # Clean up the file if it was saved
-            if settings.USE_S3_STORAGE:
-                if s3_key and s3_storage.file_exists(s3_key):
-                    s3_storage.delete_file(s3_key)
-                if temp_file_path and os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-            else:
-                file_path = os.path.join(settings.UPLOAD_DIR, unique_filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            
-            # Add to failed uploads
-            failed_uploads.append({
-                "filename": file.filename,
-                "reason": f"Error processing document: {str(e)}"
-            })
-        finally:
-            # Clean up temporary file if it exists
-            if settings.USE_S3_STORAGE and temp_file_path and os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+                return document, None
+            except Exception as e:
+                return None, {
+                    "filename": file.filename,
+                    "reason": f"Error storing document: {str(e)}"
+                }
+    
+    # Store all files concurrently; gather preserves the upload order, and handle_one reports failures itself
+    results = await asyncio.gather(*(handle_one(file) for file in files))
+    
+    processed_documents = []
+    failed_uploads = []
+    for document, failure in results:
+        if document is not None:
+            processed_documents.append(document)
+        if failure is not None:
+            failed_uploads.append(failure)
     
     # If no documents were processed successfully, return an error
     if not processed_documents and failed_uploads:
@@ -189,100 +256,211 @@ async def upload_documents(
     
 
 
+@router.post("/upload-stream", response_model=DocumentResponse)
+async def upload_document_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    filename: str = Query(..., description="Original filename, used to detect the file type"),
+    document_processor: DocumentProcessor = Depends(get_document_processor),
+    azure_search_service: AzureSearchService = Depends(get_azure_search_service),
+    s3_storage: Optional[S3StorageService] = Depends(get_s3_storage_service),
+):
+    """
+    Upload a single document sent as the raw request body.
+    The body is streamed chunk by chunk into a spooled temporary file, so memory stays
+    bounded regardless of the upload size.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ['.pdf', '.csv']:
+        raise HTTPException(status_code=400, detail="Unsupported file type. Only PDF and CSV files are supported")
+    
+    with tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MAX_SIZE) as spool:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail="File too large")
+            spool.write(chunk)
+        
+        if size == 0:
+            raise HTTPException(status_code=400, detail="No file uploaded")
+        spool.seek(0)
+        
+        try:
+            return await _store_and_queue_document(
+                background_tasks, spool, filename, file_ext,
+                document_processor, azure_search_service, s3_storage
+            )
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error storing document: {str(e)}")
+
+
 @router.get("/", response_model=DocumentListResponse)
-async def list_documents():
+async def list_documents() -> Response:
     """
     List all uploaded documents.
     """
-    document_list = []
-    for doc_id, doc in documents_db.items():
-        document_list.append(DocumentResponse(
-            id=doc["id"],
-            filename=doc["filename"],
-            type=doc["type"],
-            summary=doc["summary"],
-            metadata=doc["metadata"]
-        ))
+    # Only ids travel over the wire; full records are fetched for cache misses
+    id_docs = await DocumentRecord.get_motor_collection().find({}, {"_id": 1}).to_list(length=None)
+    document_ids = [id_doc["_id"] for id_doc in id_docs]
+    
+    responses = {}
+    missing_ids = []
+    for doc_id in document_ids:
+        cached = _document_responses.get(doc_id)
+        if cached is None:
+            missing_ids.append(doc_id)
+        else:
+            responses[doc_id] = cached
+    if missing_ids:
+        for doc in await DocumentRecord.find({"_id": {"$in": missing_ids}}).to_list():
+            responses[doc.id] = _document_response(doc)
+            # Documents still in flight (or failed) change status later, so only cache ready ones
+            if doc.status == "ready":
+                _document_responses[doc.id] = responses[doc.id]
     
-    return DocumentListResponse(documents=document_list)
+    # Returning a Response skips FastAPI re-validating the constructed models against response_model
+    return Response(
+        content=DocumentListResponse.model_construct(documents=[
+            responses[doc_id] for doc_id in document_ids if doc_id in responses
+        ]).model_dump_json(),
+        media_type="application/json"
+    )
 
 @router.get("/{document_id}", response_model=DocumentResponse)
-async def get_document(document_id: str):
+async def get_document(document_id: str) -> Response:
     """
     Get document details by ID.
     """
-    if document_id not in documents_db:
+    doc = await DocumentRecord.get(document_id)
+    if not doc:
+        _document_responses.pop(document_id, None)
         raise HTTPException(status_code=404, detail="Document not found")
     
-    doc = documents_db[document_id]
-    return DocumentResponse(
-        id=doc["id"],
-        filename=doc["filename"],
-        type=doc["type"],
-        summary=doc["summary"],
-        metadata=doc["metadata"]
-    )
+    response = _document_responses.get(document_id)
+    if response is None:
+        response = _document_response(doc)
+        if doc.status == "ready":
+            _document_responses[document_id] = response
+    return Response(content=response.model_dump_json(), media_type="application/json")
 
 @router.delete("/{document_id}")
-async def delete_document(document_id: str):
+async def delete_document(
+    document_id: str,
+    background_tasks: BackgroundTasks,
+    azure_search_service: AzureSearchService = Depends(get_azure_search_service),
+    s3_storage: Optional[S3StorageService] = Depends(get_s3_storage_service),
+):
     """
     Delete a document by ID.
     """
-    if document_id not in documents_db:
+    doc = await DocumentRecord.get(document_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    doc = documents_db[document_id]
-    
     # Delete the file based on storage type
-    if doc.get("storage_type") == "s3" and settings.USE_S3_STORAGE:
-        s3_key = doc["path"]
-        if s3_storage.file_exists(s3_key):
-            s3_storage.delete_file(s3_key)
+    if doc.storage_type == "s3" and settings.USE_S3_STORAGE:
+        await asyncio.to_thread(_remove_s3_object, s3_storage, doc.path)
     else:
         # Local file
-        file_path = doc["path"]
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        await asyncio.to_thread(_remove_local_file, doc.path)
     
-    # Remove from in-memory database
-    del documents_db[document_id]
+    # Remove from the document store
+    await doc.delete()
+    _document_responses.pop(document_id, None)
     
-    # Note: In a real implementation, you would also delete the document chunks
-    # from Azure Search. This would require implementing a deletion method
-    # in the AzureSearchService class.
+    # Purge the document's chunks from Azure Search (in background)
+    background_tasks.add_task(azure_search_service.delete_chunks_by_document_id, document_id)
     
     return {"message": f"Document {document_id} deleted successfully"}
 
+@router.post("/clear-cache")
+async def clear_document_cache():
+    """
+    Clear this worker's cache of document list responses.
+    Documents themselves are unaffected and are reloaded from MongoDB on demand.
+    """
+    _document_responses.clear()
+    return {"message": "Document cache cleared successfully"}
+
 @router.get("/{document_id}/summary")
 async def get_document_summary(document_id: str):
     """
     Get the basic metadata-based summary for a document.
     This returns the quick summary generated during document upload.
     """
-    if document_id not in documents_db:
+    doc = await DocumentRecord.get(document_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Return the basic metadata summary that was generated during upload
-    doc = documents_db[document_id]
-    summary = doc.get("summary", "No basic summary available")
+    summary = doc.summary or "No basic summary available"
     
     return {"document_id": document_id, "summary": summary}
 
+class AdvancedSummariesRequest(BaseModel):
+    document_ids: List[str]
+
+@router.post("/advanced-summaries")
+async def get_advanced_document_summaries(
+    summaries_request: AdvancedSummariesRequest,
+    qa_service: QAService = Depends(get_qa_service),
+):
+    """
+    Generate map-reduce summaries for several documents in one request.
+    Documents that are missing or still processing are reported instead of summarized.
+    """
+    document_ids = list(dict.fromkeys(summaries_request.document_ids))
+    records = await asyncio.gather(*(DocumentRecord.get(document_id) for document_id in document_ids))
+    
+    results: Dict[str, Dict[str, Any]] = {}
+    ready_ids = []
+    for document_id, doc in zip(document_ids, records):
+        if not doc:
+            results[document_id] = {"document_id": document_id, "summary": "Document not found", "error": True}
+        elif doc.status != "ready":
+            results[document_id] = {
+                "document_id": document_id,
+                "summary": f"Document is still processing. Current status: {doc.status or 'unknown'}",
+                "is_processing": True
+            }
+        else:
+            ready_ids.append(document_id)
+    
+    if ready_ids:
+        try:
+            summaries = await qa_service.generate_summaries(ready_ids)
+            for document_id in ready_ids:
+                results[document_id] = {"document_id": document_id, "summary": summaries[document_id]}
+        except Exception as e:
+            logger.error(f"Error generating advanced summaries: {e}")
+            for document_id in ready_ids:
+                results[document_id] = {
+                    "document_id": document_id,
+                    "summary": f"Could not generate advanced summary: {str(e)}",
+                    "error": True
+                }
+    
+    return {"summaries": [results[document_id] for document_id in document_ids]}
+
 @router.get("/{document_id}/advanced-summary")
-async def get_advanced_document_summary(document_id: str):
+async def get_advanced_document_summary(
+    document_id: str,
+    qa_service: QAService = Depends(get_qa_service),
+):
     """
     Generate a comprehensive AI summary for a document using map-reduce summarization.
     This always uses the LLM to create a detailed summary of the document content.
     """
-    if document_id not in documents_db:
+    doc = await DocumentRecord.get(document_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Check if document is ready
-    doc = documents_db[document_id]
-    if doc.get("status") != "ready":
+    if doc.status != "ready":
         return {
             "document_id": document_id,
-            "summary": f"Document is still processing. Current status: {doc.get('status', 'unknown')}",
+            "summary": f"Document is still processing. Current status: {doc.status or 'unknown'}",
             "is_processing": True
         }
     
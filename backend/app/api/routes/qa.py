@@ -1,24 +1,37 @@
+import orjson
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
 from app.core.qa_chain import QAService
-from app.api.models.qa import QuestionRequest, SourceDocument, AnswerResponse
+from app.dependencies import get_qa_service
+from app.api.models.qa import QuestionRequest, AnswerResponse
 from app.api.models.chat import Chat, Message
 
 router = APIRouter()
 
-# Initialize QA service
-qa_service = QAService()
-
 class QuestionWithChatRequest(BaseModel):
     """Model for question request with optional chat ID."""
     question: str
     chat_id: Optional[str] = None
     is_regeneration: Optional[bool] = False
 
+def _answer_response(answer: str, sources: List[Dict[str, Any]]) -> Response:
+    """
+    Serialize QA output straight to JSON. Returning a Response skips FastAPI's validation
+    against response_model, which still documents the schema.
+    """
+    return Response(
+        content=orjson.dumps({"answer": answer, "sources": sources}),
+        media_type="application/json"
+    )
+
 @router.post("/ask", response_model=AnswerResponse)
-async def ask_question(question_request: QuestionWithChatRequest):
+async def ask_question(
+    question_request: QuestionWithChatRequest,
+    qa_service: QAService = Depends(get_qa_service)
+):
     """
     Answer a question based on the uploaded documents.
     Optionally use a chat_id to maintain conversation context.
@@ -31,38 +44,63 @@ async def ask_question(question_request: QuestionWithChatRequest):
         if not question or question.strip() == "":
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
-        # If chat_id is provided, load the chat history synchronously first
-        chat_history = None
-        if chat_id:
-            # Get messages for this chat from MongoDB
-            messages = await Message.find({"chat_id": chat_id}).sort("+timestamp").to_list()
-            
-            # Format messages for the prompt
-            if messages:
-                chat_history = "\n\n".join([
-                    f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}"
-                    for msg in messages
-                ])
-        
-        # Get answer from QA service, passing chat history directly
-        answer, sources = qa_service.answer_question(question, chat_id, chat_history)
+        # If chat_id is provided, load the recent chat history first
+        chat_history = await Message.format_history(chat_id) if chat_id else None
         
-        # Convert sources to the expected format
-        formatted_sources = [
-            SourceDocument(text=source["text"], metadata=source["metadata"])
-            for source in sources
-        ]
+        # Get answer from QA service, passing chat history directly; regenerations bypass the answer cache
+        answer, sources = await qa_service.answer_question(
+            question, chat_id, chat_history, use_cache=not question_request.is_regeneration
+        )
         
-        return AnswerResponse(answer=answer, sources=formatted_sources)
+        return _answer_response(answer, sources)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
+@router.post("/ask/stream")
+async def ask_question_stream(
+    question_request: QuestionWithChatRequest,
+    document_id: Optional[str] = Query(None, description="Optional document ID to restrict the answer to"),
+    qa_service: QAService = Depends(get_qa_service)
+):
+    """
+    Answer a question as server-sent events, streaming answer tokens as they are generated.
+    The first event carries the sources; the last is a "done" (or "error") event.
+    """
+    question = question_request.question
+    chat_id = question_request.chat_id
+    
+    if not question or question.strip() == "":
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    # If chat_id is provided, load the recent chat history first
+    chat_history = await Message.format_history(chat_id) if chat_id else None
+    
+    async def event_stream():
+        try:
+            async for event in qa_service.answer_question_stream(
+                question,
+                chat_id,
+                chat_history,
+                document_id=document_id,
+                use_cache=not question_request.is_regeneration
+            ):
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield b"data: " + orjson.dumps({"type": "error", "detail": f"Error answering question: {str(e)}"}) + b"\n\n"
+    
+    # An explicit Content-Encoding keeps GZipMiddleware from buffering events inside its compressor
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers={"Content-Encoding": "identity"}
+    )
+
 @router.get("/documents/{document_id}/ask", response_model=AnswerResponse)
 async def ask_document_question(
     document_id: str, 
     question: str = Query(..., description="The question to ask"),
-    chat_id: Optional[str] = Query(None, description="Optional chat ID for conversation context")
+    chat_id: Optional[str] = Query(None, description="Optional chat ID for conversation context"),
+    qa_service: QAService = Depends(get_qa_service)
 ):
     """
     Answer a question about a specific document.
@@ -72,34 +110,19 @@ async def ask_document_question(
         if not question or question.strip() == "":
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
-        # If chat_id is provided, load the chat history synchronously first
-        chat_history = None
-        if chat_id:
-            # Get messages for this chat from MongoDB
-            messages = await Message.find({"chat_id": chat_id}).sort("+timestamp").to_list()
-            
-            # Format messages for the prompt
-            if messages:
-                chat_history = "\n\n".join([
-                    f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}"
-                    for msg in messages
-                ])
+        # If chat_id is provided, load the recent chat history first
+        chat_history = await Message.format_history(chat_id) if chat_id else None
         
         # Get answer from QA service, passing document_id and chat history directly
-        answer, sources = qa_service.answer_document_question(question, document_id, chat_id, chat_history)
-        
-        formatted_sources = [
-            SourceDocument(text=source["text"], metadata=source["metadata"])
-            for source in sources
-        ]
+        answer, sources = await qa_service.answer_document_question(question, document_id, chat_id, chat_history)
         
-        return AnswerResponse(answer=answer, sources=formatted_sources)
+        return _answer_response(answer, sources)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
 @router.post("/clear-memory")
-async def clear_qa_memory():
+async def clear_qa_memory(qa_service: QAService = Depends(get_qa_service)):
     """
     Clear the QA service's conversation memory.
     Useful for testing or when starting fresh conversations.
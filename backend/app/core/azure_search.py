@@ -1,11 +1,21 @@
 import asyncio
-import json
+import heapq
+import hashlib
+import orjson
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+import simsimd
+from datasketch import MinHash, MinHashLSH
+from typing import Any, Awaitable, Callable, ClassVar, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 from azure.core.exceptions import ResourceNotFoundError
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+from azure.search.documents import SearchClient, SearchIndexingBufferedSender
 from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.models import VectorizedQuery
 from azure.search.documents.indexes.models import (
     SearchIndex,
     SimpleField,
@@ -16,14 +26,205 @@ from azure.search.documents.indexes.models import (
     VectorSearchProfile,
     HnswAlgorithmConfiguration,
     HnswParameters,
+    RescoringOptions,
+    ScalarQuantizationCompression,
+    ScalarQuantizationParameters,
 )
 from langchain_community.retrievers import AzureAISearchRetriever
 from langchain_openai import AzureOpenAIEmbeddings
 from app.config import settings
+from app.core.embedding_cache import get_cached_embeddings, store_embeddings
+from app.utils.helpers import LRUCache
 
 logger = logging.getLogger(__name__)
 
 
+def cosine_similarities(query_vector: Sequence[float], candidate_vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    """
+    Return the cosine similarity of the query to each candidate using SimSIMD's SIMD kernels.
+    float16 inputs are compared as-is instead of being widened first.
+    """
+    candidates = np.asarray(candidate_vectors)
+    if candidates.dtype not in (np.float16, np.float32):
+        candidates = candidates.astype(np.float32)
+    query = np.asarray(query_vector, dtype=candidates.dtype).reshape(1, -1)
+    return 1.0 - np.asarray(simsimd.cdist(query, candidates, metric="cosine")).reshape(-1)
+
+
+def cosine_top_k(query_vector: Sequence[float], candidate_vectors: Sequence[Sequence[float]], k: int) -> List[int]:
+    """Return the indices of the k candidates most cosine-similar to the query, best first."""
+    if not len(candidate_vectors) or k <= 0:
+        return []
+    scores = cosine_similarities(query_vector, candidate_vectors)
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])].tolist()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Any]], key: Callable[[Any], Any], top_n: int, k: int = 60
+) -> List[Any]:
+    """
+    Fuse several ranked result lists with Reciprocal Rank Fusion: each item scores
+    sum(1 / (k + rank)) over the lists it appears in. Returns the top_n items, best first.
+    """
+    scores: Dict[Any, float] = {}
+    items: Dict[Any, Any] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in heapq.nlargest(top_n, scores, key=scores.__getitem__)]
+
+
+def normalize_vectors_fp16(vectors: Sequence[Sequence[float]]) -> List[List[float]]:
+    """
+    Scale vectors to unit length and round them to float16 for the Half vector field.
+    Unit vectors let the index rank by dot product, which equals cosine similarity.
+    """
+    if not len(vectors):
+        return []
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    return matrix.astype(np.float16).tolist()
+
+
+def near_duplicate_representatives(texts: Sequence[str], threshold: float, num_perm: int = 128) -> List[int]:
+    """
+    Map each text to the index of the earliest text whose word-set Jaccard similarity is
+    estimated (MinHash LSH) to be at least threshold, or to its own index if there is none.
+    """
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    representatives = []
+    for i, text in enumerate(texts):
+        minhash = MinHash(num_perm=num_perm)
+        minhash.update_batch([token.encode("utf-8") for token in set(text.split())])
+        matches = lsh.query(minhash)
+        if matches:
+            representatives.append(min(matches))
+        else:
+            # Only representatives are inserted, so every match is one
+            lsh.insert(i, minhash)
+            representatives.append(i)
+    return representatives
+
+
+def unique_documents(docs: Iterable[Any]) -> List[Any]:
+    """Drop documents whose text repeats an earlier one, keeping the first (best ranked) copy."""
+    seen: Set[str] = set()
+    unique = []
+    for doc in docs:
+        if doc.page_content not in seen:
+            seen.add(doc.page_content)
+            unique.append(doc)
+    return unique
+
+
+def content_hash(content: str) -> str:
+    """Return a stable hex digest identifying chunk content."""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> AzureOpenAIEmbeddings:
+    """Return the process-wide embedding client."""
+    return AzureOpenAIEmbeddings(
+        azure_deployment=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        api_key=settings.AZURE_OPENAI_API_KEY,
+        azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        api_version=settings.AZURE_OPENAI_EMBEDDING_API_VERSION,
+        chunk_size=settings.EMBED_BATCH_SIZE,
+        max_retries=6,  # Back off and retry throttled (429) requests
+    )
+
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces query embeddings requested concurrently on the event loop into one
+    embed_many call, flushed once max_batch texts are waiting or after max_wait seconds.
+    """
+
+    def __init__(self, embed_many: Callable[[List[str]], List[List[float]]], max_batch: int = 16, max_wait: float = 0.02):
+        self._embed_many = embed_many
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # The event loop only keeps weak references to tasks, so running batches are held here
+        self._running: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> List[float]:
+        """Queue a text and wait for its embedding from the next batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            embeddings = await asyncio.to_thread(self._embed_many, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+
+class CachedRetriever:
+    """
+    Wraps a LangChain retriever and memoizes its results per query through the search
+    service's retrieval cache, which is keyed by index version, so any upload or delete
+    makes earlier results unreachable. Chunks with identical text are returned once,
+    without their embeddings.
+    """
+
+    def __init__(self, retriever: AzureAISearchRetriever, search_service: "AzureSearchService", scope: Tuple[Any, ...]):
+        self.retriever = retriever
+        self._search_service = search_service
+        self._scope = scope
+
+    def _prepare(self, docs: List[Any]) -> List[Any]:
+        """Dedupe results and drop each chunk's embedding, which callers never use but would otherwise serialize."""
+        docs = unique_documents(docs)
+        vector_field = self._search_service.schema_config.content_vector_field
+        for doc in docs:
+            doc.metadata.pop(vector_field, None)
+        return docs
+
+    def invoke(self, query: str, *args: Any, **kwargs: Any) -> List[Any]:
+        return self._search_service.cached_retrieve(
+            (self._scope, query), lambda: self._prepare(self.retriever.invoke(query, *args, **kwargs))
+        )
+
+    async def ainvoke(self, query: str, *args: Any, **kwargs: Any) -> List[Any]:
+        """
+        Retrieve asynchronously. Concurrent calls for the same uncached query share one
+        search request instead of each sending their own.
+        """
+        async def search() -> List[Any]:
+            return self._prepare(await self.retriever.ainvoke(query, *args, **kwargs))
+
+        return await self._search_service.acached_retrieve((self._scope, query), search)
+
+
 class SchemaConfig:
     """Configuration for the Azure AI Search index schema."""
 
@@ -34,19 +235,31 @@ class SchemaConfig:
         content_vector_field: str = "content_vector",
         metadata_field: str = "metadata",
         document_id_field: str = "document_id",
+        content_hash_field: str = "content_hash",
+        source_field: str = "source",
+        type_field: str = "type",
+        chunk_index_field: str = "chunk_index",
         vector_dimensions: int = 3072,
         vector_search_profile_name: str = "my-vector-config",
         hnsw_parameters: Optional[HnswParameters] = None,
+        compression_name: str = "sq-config",
     ):
         self.id_field = id_field
         self.content_field = content_field
         self.content_vector_field = content_vector_field
         self.metadata_field = metadata_field
         self.document_id_field = document_id_field
+        self.content_hash_field = content_hash_field
+        self.source_field = source_field
+        self.type_field = type_field
+        self.chunk_index_field = chunk_index_field
         self.vector_dimensions = vector_dimensions
         self.vector_search_profile_name = vector_search_profile_name
+        self.compression_name = compression_name
+        # Graph degree drives recall for 3072-dimension vectors; existing indexes keep
+        # their parameters until the index is recreated and documents are re-uploaded
         self.hnsw_parameters = hnsw_parameters or HnswParameters(
-            m=4, ef_construction=400, ef_search=500, metric="cosine"
+            m=16, ef_construction=400, ef_search=100, metric="dotProduct"
         )
 
 
@@ -56,6 +269,10 @@ class AzureSearchService:
     Supports index creation, document upload, vector search, and LangChain integration.
     """
 
+    # Index names verified in this process, shared by every instance
+    _ready_indexes: ClassVar[Set[str]] = set()
+    _ready_indexes_lock: ClassVar[threading.Lock] = threading.Lock()
+
     def __init__(self, schema_config: Optional[SchemaConfig] = None):
         """Initialize the Azure AI Search service with schema and credentials."""
         self.schema_config = schema_config or SchemaConfig()
@@ -73,15 +290,22 @@ class AzureSearchService:
             credential=self.credential,
         )
 
-        # Initialize embedding model
-        self.embeddings = AzureOpenAIEmbeddings(
-            azure_deployment=settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
-            api_version=settings.AZURE_OPENAI_EMBEDDING_API_VERSION,
-        )
+        # Shared embedding model, so every service reuses one HTTP connection pool
+        self.embeddings = get_embeddings()
+
+        # Query embeddings keyed by a digest of the query text
+        self._query_embedding_cache = LRUCache(maxsize=settings.QUERY_EMBEDDING_CACHE_SIZE)
+        self._query_embedding_lock = threading.Lock()
+        self._query_batcher = QueryEmbeddingBatcher(self.embed_many)
 
-        self._ensure_index_exists()
+        # Bumped whenever indexed content changes, so callers can invalidate derived caches
+        self.index_version = 0
+
+        # LangChain retrievers keyed by (top_k, document_id), and the documents they returned
+        self._retrievers = LRUCache(maxsize=128)
+        self._retrieval_cache = LRUCache(maxsize=settings.RETRIEVAL_CACHE_SIZE)
+        # Searches currently running, so concurrent identical queries await the same one
+        self._retrievals_in_flight: Dict[Tuple[Any, ...], asyncio.Future] = {}
 
     def _get_index_definition(self) -> SearchIndex:
         """Build and return the SearchIndex definition based on schema configuration."""
@@ -99,15 +323,15 @@ class AzureSearchService:
             ),
             SearchField(
                 name=self.schema_config.content_vector_field,
-                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                type=SearchFieldDataType.Collection(SearchFieldDataType.Half),
                 searchable=True,
                 vector_search_dimensions=self.schema_config.vector_dimensions,
                 vector_search_profile_name=self.schema_config.vector_search_profile_name,
             ),
-            SearchableField(
+            # Metadata is a JSON blob that is filtered on but never full-text searched
+            SimpleField(
                 name=self.schema_config.metadata_field,
                 type=SearchFieldDataType.String,
-                searchable=True,
                 filterable=True,
             ),
             SimpleField(
@@ -115,6 +339,28 @@ class AzureSearchService:
                 type=SearchFieldDataType.String,
                 filterable=True,
             ),
+            SimpleField(
+                name=self.schema_config.content_hash_field,
+                type=SearchFieldDataType.String,
+                filterable=True,
+            ),
+            # Known metadata keys as native fields, filterable server-side
+            SimpleField(
+                name=self.schema_config.source_field,
+                type=SearchFieldDataType.String,
+                filterable=True,
+            ),
+            SimpleField(
+                name=self.schema_config.type_field,
+                type=SearchFieldDataType.String,
+                filterable=True,
+            ),
+            SimpleField(
+                name=self.schema_config.chunk_index_field,
+                type=SearchFieldDataType.Int32,
+                filterable=True,
+                sortable=True,
+            ),
         ]
 
         vector_search = VectorSearch(
@@ -122,6 +368,7 @@ class AzureSearchService:
                 VectorSearchProfile(
                     name=self.schema_config.vector_search_profile_name,
                     algorithm_configuration_name="hnsw-config",
+                    compression_name=self.schema_config.compression_name,
                 )
             ],
             algorithms=[
@@ -130,26 +377,123 @@ class AzureSearchService:
                     parameters=self.schema_config.hnsw_parameters,
                 )
             ],
+            compressions=[
+                # int8 graph with oversampled candidates rescored against the original vectors
+                ScalarQuantizationCompression(
+                    compression_name=self.schema_config.compression_name,
+                    parameters=ScalarQuantizationParameters(quantized_data_type="int8"),
+                    rescoring_options=RescoringOptions(
+                        enable_rescoring=True,
+                        default_oversampling=settings.VECTOR_REFINE_FACTOR,
+                        rescore_storage_method="preserveOriginals",
+                    ),
+                )
+            ],
         )
 
         return SearchIndex(name=self.index_name, fields=fields, vector_search=vector_search)
 
+    def ensure_index(self) -> None:
+        """Verify the index once per process; later calls return without a round trip."""
+        if self.index_name in self._ready_indexes:
+            return
+        with self._ready_indexes_lock:
+            if self.index_name not in self._ready_indexes:
+                self._ensure_index_exists()
+                self._ready_indexes.add(self.index_name)
+
     def _ensure_index_exists(self) -> None:
+        """Create the index if it is missing and add any schema fields it lacks, without dropping data."""
         try:
-            self.index_client.get_index(self.index_name)
-            logger.info(f"Index '{self.index_name}' already exists.")
+            existing_index = self.index_client.get_index(self.index_name)
         except ResourceNotFoundError:
             logger.warning(f"Index '{self.index_name}' not found. Creating a new one...")
             index_definition = self._get_index_definition()
             self.index_client.create_index(index_definition)
             logger.info(f"Successfully created index '{self.index_name}'.")
+            return
         except Exception as e:
             logger.error(f"Failed to check or create index '{self.index_name}': {e}")
             raise
+
+        index_definition = self._get_index_definition()
+        existing_fields = {field.name: field for field in existing_index.fields}
+        missing_fields = []
+        for field in index_definition.fields:
+            existing_field = existing_fields.get(field.name)
+            if existing_field is None:
+                missing_fields.append(field.name)
+            elif (
+                existing_field.type != field.type
+                or existing_field.vector_search_dimensions != field.vector_search_dimensions
+            ):
+                # Changing a field type requires a rebuild, which would drop every indexed chunk
+                logger.error(
+                    f"Index '{self.index_name}' field '{field.name}' does not match the configured schema; "
+                    f"recreate the index manually to apply the change."
+                )
+
+        if not missing_fields:
+            logger.info(f"Index '{self.index_name}' already exists.")
+            return
+
+        try:
+            existing_index.fields.extend(
+                field for field in index_definition.fields if field.name in missing_fields
+            )
+            self.index_client.create_or_update_index(existing_index)
+            logger.info(f"Added fields {missing_fields} to index '{self.index_name}'.")
+        except Exception as e:
+            logger.error(f"Failed to update index '{self.index_name}': {e}")
+            raise
         
-    async def upload_chunks(self, chunks: List[Dict[str, Any]]) -> None:
-        """Upload document chunks to Azure AI Search with computed embeddings."""
-        documents = []
+    async def upload_chunks(self, chunks: Iterable[Dict[str, Any]]) -> None:
+        """
+        Upload document chunks to Azure AI Search with computed embeddings.
+        Chunks are consumed in windows, so a lazily produced stream is embedded while later
+        chunks are still being extracted, and each window is indexed while the next is embedded.
+        """
+        await asyncio.to_thread(self.ensure_index)
+        chunk_iter = iter(chunks)
+        window_size = settings.EMBED_BATCH_SIZE * settings.EMBED_CONCURRENCY
+        indexing: Optional[asyncio.Future] = None
+        uploaded = 0
+        try:
+            while True:
+                # Producing the next window may extract PDF pages, so keep it off the event loop
+                window = await asyncio.to_thread(lambda: list(islice(chunk_iter, window_size)))
+                if not window:
+                    break
+                documents = await self._prepare_documents(window)
+                if indexing is not None:
+                    await indexing
+                    indexing = None
+                if documents:
+                    # Use sync sender but in a way that doesn't block the event loop
+                    indexing = asyncio.ensure_future(asyncio.to_thread(self._index_documents, documents))
+                    uploaded += len(documents)
+            if indexing is not None:
+                await indexing
+                indexing = None
+        except Exception as e:
+            logger.error(f"Failed to upload documents: {e}")
+            raise
+        finally:
+            if indexing is not None:
+                # Let an in-flight window finish before surfacing the error
+                await asyncio.gather(indexing, return_exceptions=True)
+            if uploaded:
+                self.index_version += 1
+
+        if not uploaded:
+            logger.warning("No valid documents to upload.")
+            return
+        logger.info(f"Uploaded {uploaded} documents.")
+
+    async def _prepare_documents(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Validate chunks and build their index documents, embedding only chunks with no known vector."""
+        contents = []
+        records = []
         for chunk in chunks:
             content = chunk.get("text") or chunk.get(self.schema_config.content_field)
             if not content:
@@ -166,48 +510,237 @@ class AzureSearchService:
             if document_id is None:
                 raise ValueError("Metadata must contain 'document_id'")
 
-            embedding = self.embeddings.embed_query(content)
-            document = {
-                self.schema_config.id_field: str(chunk_id),
+            contents.append(content)
+            records.append((str(chunk_id), chunk_metadata, document_id))
+
+        # Reuse vectors of identical chunks already in the index
+        content_hashes = [content_hash(content) for content in contents]
+        embeddings = await asyncio.to_thread(self._fetch_vectors_by_hash, content_hashes) if contents else []
+
+        # Then vectors cached from earlier uploads, which outlive deleted documents
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            try:
+                cached = await get_cached_embeddings([content_hashes[i] for i in missing])
+                for i, embedding in zip(missing, cached):
+                    embeddings[i] = embedding
+            except Exception as e:
+                logger.warning(f"Failed to read the embedding cache: {e}")
+
+        # Embed the remaining chunks in batched requests, once per distinct content
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        embedded = 0
+        if missing:
+            first_by_hash: Dict[str, int] = {}
+            for i in missing:
+                first_by_hash.setdefault(content_hashes[i], i)
+            unique_hashes = list(first_by_hash)
+
+            # Near-duplicates (page numbers, whitespace, OCR noise) borrow a representative's vector
+            representatives = list(range(len(unique_hashes)))
+            if settings.NEAR_DUPLICATE_THRESHOLD < 1.0:
+                representatives = await asyncio.to_thread(
+                    near_duplicate_representatives,
+                    [contents[first_by_hash[chunk_hash]] for chunk_hash in unique_hashes],
+                    settings.NEAR_DUPLICATE_THRESHOLD,
+                )
+            to_embed = [j for j, representative in enumerate(representatives) if representative == j]
+            new_embeddings = await asyncio.to_thread(
+                self._embed_in_batches, [contents[first_by_hash[unique_hashes[j]]] for j in to_embed]
+            )
+            embedded_by_position = dict(zip(to_embed, normalize_vectors_fp16(new_embeddings)))
+            vectors_by_hash = {
+                chunk_hash: embedded_by_position[representatives[j]] for j, chunk_hash in enumerate(unique_hashes)
+            }
+            for i in missing:
+                embeddings[i] = vectors_by_hash[content_hashes[i]]
+            try:
+                # Only exact embeddings are cached, so the cache never serves a borrowed vector
+                await store_embeddings({unique_hashes[j]: embedded_by_position[j] for j in to_embed})
+            except Exception as e:
+                logger.warning(f"Failed to write the embedding cache: {e}")
+            embedded = len(to_embed)
+        logger.info(f"Embedded {embedded} of {len(contents)} chunks; reused the rest from the index, cache or near-duplicates.")
+
+        return [
+            {
+                self.schema_config.id_field: chunk_id,
                 self.schema_config.content_field: content,
                 self.schema_config.content_vector_field: embedding,
-                self.schema_config.metadata_field: json.dumps(chunk_metadata),
+                self.schema_config.metadata_field: orjson.dumps(chunk_metadata).decode(),
                 self.schema_config.document_id_field: document_id,
+                self.schema_config.content_hash_field: chunk_hash,
+                self.schema_config.source_field: chunk_metadata.get("source"),
+                self.schema_config.type_field: chunk_metadata.get("type"),
+                self.schema_config.chunk_index_field: chunk_metadata.get("chunk_index"),
             }
-            documents.append(document)
+            for content, (chunk_id, chunk_metadata, document_id), embedding, chunk_hash
+            in zip(contents, records, embeddings, content_hashes)
+        ]
 
-        if not documents:
-            logger.warning("No valid documents to upload.")
-            return
+    def _embed_in_batches(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts in requests of at most EMBED_BATCH_SIZE items, preserving input order.
+        Up to EMBED_CONCURRENCY batches are in flight at once.
+        """
+        batch_size = settings.EMBED_BATCH_SIZE
+        batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) <= 1:
+            return self.embeddings.embed_documents(texts) if texts else []
 
-        # print(documents)
-        batch_size = 100
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i : i + batch_size]
+        with ThreadPoolExecutor(max_workers=min(settings.EMBED_CONCURRENCY, len(batches))) as executor:
+            # Collect in submission order so vectors stay aligned with their texts
+            futures = [executor.submit(self.embeddings.embed_documents, batch) for batch in batches]
+            return [embedding for future in futures for embedding in future.result()]
+
+    def _fetch_vectors_by_hash(self, content_hashes: List[str], batch_size: int = 100) -> List[Optional[List[float]]]:
+        """Look up stored vectors for the given content hashes, returning None where none is indexed."""
+        vectors_by_hash: Dict[str, List[float]] = {}
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        for i in range(0, len(unique_hashes), batch_size):
+            batch = unique_hashes[i : i + batch_size]
             try:
-                # Use sync client but in a way that doesn't block the event loop
-                await asyncio.to_thread(self.search_client.upload_documents, documents=batch)
-                logger.info(f"Uploaded batch {i // batch_size + 1}: {len(batch)} documents.")
+                results = self.search_client.search(
+                    search_text=None,
+                    filter=f"search.in({self.schema_config.content_hash_field}, '{','.join(batch)}', ',')",
+                    select=[self.schema_config.content_hash_field, self.schema_config.content_vector_field],
+                    top=1000,
+                )
+                for result in results:
+                    vectors_by_hash.setdefault(
+                        result[self.schema_config.content_hash_field],
+                        result[self.schema_config.content_vector_field],
+                    )
             except Exception as e:
-                logger.error(f"Failed to upload batch starting at index {i}: {e}")
-                raise
+                # A failed lookup only costs a re-embedding, so don't fail the upload
+                logger.warning(f"Failed to look up existing chunk vectors: {e}")
+        return [vectors_by_hash.get(chunk_hash) for chunk_hash in content_hashes]
+
+    async def delete_chunks_by_document_id(self, document_id: str) -> int:
+        """Delete every indexed chunk of a document and return how many were removed."""
+        deleted = await asyncio.to_thread(self._delete_chunks_by_document_id, document_id)
+        self.index_version += 1
+        return deleted
+
+    def _delete_chunks_by_document_id(self, document_id: str, batch_size: int = 1000) -> int:
+        """Collect the chunk ids of a document, then delete them in batches."""
+        escaped_id = document_id.replace("'", "''")
+        results = self.search_client.search(
+            search_text=None,
+            filter=f"{self.schema_config.document_id_field} eq '{escaped_id}'",
+            select=[self.schema_config.id_field],
+        )
+        chunk_ids = [result[self.schema_config.id_field] for result in results]
+
+        for i in range(0, len(chunk_ids), batch_size):
+            self.search_client.delete_documents(documents=[
+                {self.schema_config.id_field: chunk_id} for chunk_id in chunk_ids[i : i + batch_size]
+            ])
+        logger.info(f"Deleted {len(chunk_ids)} chunks for document {document_id}.")
+        return len(chunk_ids)
+
+    def _make_buffered_sender(self, on_error: Callable[[Any], None]) -> SearchIndexingBufferedSender:
+        """Create a buffered sender that batches, splits and retries indexing requests."""
+        return SearchIndexingBufferedSender(
+            endpoint=self.service_endpoint,
+            index_name=self.index_name,
+            credential=self.credential,
+            auto_flush_interval=5,
+            initial_batch_action_count=500,
+            on_error=on_error,
+        )
+
+    def _index_documents(self, documents: List[Dict[str, Any]]) -> None:
+        """Index documents through a buffered sender, raising if any action ultimately fails."""
+        failed_actions = []
+        with self._make_buffered_sender(on_error=failed_actions.append) as sender:
+            sender.upload_documents(documents=documents)
+        if failed_actions:
+            raise RuntimeError(f"Failed to index {len(failed_actions)} of {len(documents)} documents")
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, reusing the embedding of an identical earlier query."""
+        return self.embed_many([query])[0]
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """
+        Embed a query from async code. Cached queries return immediately; the rest are
+        batched with other queries arriving at the same time into one embeddings request.
+        """
+        with self._query_embedding_lock:
+            cached = self._query_embedding_cache.get(self._query_cache_key(query))
+        if cached is not None:
+            return cached.tolist()
+        return await self._query_batcher.embed(query)
+
+    def _query_cache_key(self, text: str) -> bytes:
+        """Digest a query text into its embedding cache key."""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several query texts with at most one embeddings request.
+        Texts embedded before are served from the cache; only the rest are sent.
+        """
+        keys = [self._query_cache_key(text) for text in texts]
+        with self._query_embedding_lock:
+            embeddings = [self._query_embedding_cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            new_embeddings = self.embeddings.embed_documents([texts[i] for i in missing])
+            with self._query_embedding_lock:
+                for i, embedding in zip(missing, new_embeddings):
+                    # Cached as float16, matching the precision of the indexed vectors
+                    embeddings[i] = self._query_embedding_cache[keys[i]] = np.asarray(embedding, dtype=np.float16)
+        return [embedding.tolist() for embedding in embeddings]
+
+    def rerank(self, query: str, texts: List[str], top_n: int) -> List[int]:
+        """
+        Return the indices of the top_n texts most similar to the query, best first.
+        The query and every candidate are embedded in a single embeddings request.
+        """
+        if len(texts) <= top_n:
+            return list(range(len(texts)))
+        vectors = self.embed_many([query, *texts])
+        return cosine_top_k(vectors[0], vectors[1:], top_n)
+
+    def _result_metadata(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Build chunk metadata from the native fields, parsing the JSON blob only for older chunks."""
+        source = result.get(self.schema_config.source_field)
+        if source is None:
+            # Chunks indexed before the metadata fields were promoted only carry the blob
+            return orjson.loads(result.get(self.schema_config.metadata_field) or "{}")
+        return {
+            "source": source,
+            "type": result.get(self.schema_config.type_field),
+            "document_id": result.get(self.schema_config.document_id_field),
+            "chunk_index": result.get(self.schema_config.chunk_index_field),
+        }
 
     def search_documents(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """Perform a vector search using the query embedding."""
         try:
-            query_embedding = self.embeddings.embed_query(query)
+            self.ensure_index()
+            query_embedding = self.embed_query(query)
             results = self.search_client.search(
-                search_text="*",  # Use wildcard for vector-only search
-                vectors=[{
-                    "value": query_embedding,
-                    "fields": self.schema_config.content_vector_field,
-                    "k": top_k,
-                }],
+                search_text=None,  # Pure vector query, no full-text scoring
+                vector_queries=[VectorizedQuery(
+                    vector=query_embedding,
+                    # The service searches max(ef_search, k) candidates, so a wider k
+                    # scales the search effort with top_k; `top` trims the results
+                    k_nearest_neighbors=max(top_k * 4, 50),
+                    fields=self.schema_config.content_vector_field,
+                )],
+                top=top_k,
                 select=[
                     self.schema_config.id_field,
                     self.schema_config.content_field,
                     self.schema_config.metadata_field,
                     self.schema_config.document_id_field,
+                    self.schema_config.source_field,
+                    self.schema_config.type_field,
+                    self.schema_config.chunk_index_field,
                 ],
             )
 
@@ -215,7 +748,7 @@ class AzureSearchService:
                 {
                     "id": result[self.schema_config.id_field],
                     "content": result[self.schema_config.content_field],
-                    "metadata": json.loads(result.get(self.schema_config.metadata_field, "{}")),
+                    "metadata": self._result_metadata(result),
                     "document_id": result.get(self.schema_config.document_id_field, None),
                     "score": result.get("@search.score", 0.0),
                 }
@@ -226,14 +759,67 @@ class AzureSearchService:
             raise
 
         
-    def create_langchain_retriever(self, top_k: int = 5, document_id: str = None) -> AzureAISearchRetriever:
-        filter_str = f"{self.schema_config.document_id_field} eq '{document_id}'" if document_id else None
-        retriever = AzureAISearchRetriever(
-            content_key=self.schema_config.content_field,
-            top_k=top_k,
-            index_name=self.index_name,
-            service_name=settings.AZURE_SEARCH_SERVICE,
-            api_key=settings.AZURE_SEARCH_KEY,
-            filter=filter_str,
+    def cached_retrieve(self, key: Tuple[Any, ...], retrieve: Callable[[], List[Any]]) -> List[Any]:
+        """
+        Return the documents cached for key at the current index version, calling retrieve
+        to fetch and cache them on a miss. Callers get their own copy of the list.
+        """
+        versioned_key = (self.index_version, key)
+        docs = self._retrieval_cache.get(versioned_key)
+        if docs is None:
+            docs = retrieve()
+            self._retrieval_cache[versioned_key] = docs
+        return list(docs)
+
+    async def acached_retrieve(
+        self, key: Tuple[Any, ...], retrieve: Callable[[], Awaitable[List[Any]]]
+    ) -> List[Any]:
+        """
+        Async cached_retrieve. Concurrent misses for the same key await one retrieve call
+        instead of each starting their own.
+        """
+        versioned_key = (self.index_version, key)
+        docs = self._retrieval_cache.get(versioned_key)
+        if docs is not None:
+            return list(docs)
+
+        task = self._retrievals_in_flight.get(versioned_key)
+        if task is None:
+            async def fetch() -> List[Any]:
+                fetched = await retrieve()
+                self._retrieval_cache[versioned_key] = fetched
+                return fetched
+
+            task = self._retrievals_in_flight[versioned_key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda _: self._retrievals_in_flight.pop(versioned_key, None))
+        # Shielded so one caller giving up does not cancel the retrieval for the others
+        return list(await asyncio.shield(task))
+
+    def create_langchain_retriever(self, top_k: int = 5, document_id: str = None) -> CachedRetriever:
+        """
+        Return a retriever for (top_k, document_id), reusing one built earlier with the same
+        settings. Its results are cached until the index changes.
+        """
+        key = (top_k, document_id)
+        retriever = self._retrievers.get(key)
+        if retriever is not None:
+            return retriever
+
+        filter_str = None
+        if document_id:
+            escaped_id = document_id.replace("'", "''")
+            filter_str = f"{self.schema_config.document_id_field} eq '{escaped_id}'"
+        retriever = CachedRetriever(
+            AzureAISearchRetriever(
+                content_key=self.schema_config.content_field,
+                top_k=top_k,
+                index_name=self.index_name,
+                service_name=settings.AZURE_SEARCH_SERVICE,
+                api_key=settings.AZURE_SEARCH_KEY,
+                filter=filter_str,
+            ),
+            search_service=self,
+            scope=key,
         )
+        self._retrievers[key] = retriever
         return retriever
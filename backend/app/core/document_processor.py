@@ -1,10 +1,60 @@
 import os
 import uuid
+import multiprocessing
+import threading
 import pandas as pd
-from PyPDF2 import PdfReader
+import pypdfium2 as pdfium
+from concurrent.futures import ProcessPoolExecutor
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from app.config import settings
-from typing import List, Dict, Tuple, Optional, Union, Any
+from typing import BinaryIO, Iterable, Iterator, List, Dict, Tuple, Optional, Union, Any
+
+# Pages per worker process. Each worker is a freshly spawned interpreter that re-imports the
+# app (pandas, langchain, settings), which costs about as much as extracting a few hundred pages.
+PARALLEL_EXTRACTION_MIN_PAGES = 400
+
+# PDFium is not thread-safe, and documents are extracted on the shared asyncio thread pool,
+# so every PDFium call in this process goes through this lock
+_pdfium_lock = threading.Lock()
+
+def _iter_page_range(source: Union[str, bytes], start: int, stop: int) -> Iterator[str]:
+    """Yield the text of pages [start, stop) of a PDF one page at a time."""
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(source)
+    try:
+        for page_index in range(start, stop):
+            # Held per page, never across a yield, so other documents interleave page by page
+            with _pdfium_lock:
+                page = pdf[page_index]
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                textpage.close()
+                page.close()
+            yield text
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+def _extract_page_range(source: Union[str, bytes], start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) of a PDF. Top-level so worker processes can run it."""
+    return list(_iter_page_range(source, start, stop))
+
+def _iter_pages(source: Union[str, bytes], num_pages: int) -> Iterator[str]:
+    """Yield the text of every page in order, splitting large PDFs into page ranges across processes."""
+    workers = min(os.cpu_count() or 1, num_pages // PARALLEL_EXTRACTION_MIN_PAGES or 1)
+    if workers <= 1:
+        yield from _iter_page_range(source, 0, num_pages)
+        return
+
+    step = -(-num_pages // workers)
+    starts = range(0, num_pages, step)
+    # Spawn rather than fork: forking the server copies locks held by its other threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        # map yields each range's pages in order as soon as that range is done
+        for texts in executor.map(
+            _extract_page_range, [source] * len(starts), starts, [min(start + step, num_pages) for start in starts]
+        ):
+            yield from texts
 
 class DocumentProcessor:
     """
@@ -18,12 +68,14 @@ class DocumentProcessor:
             length_function=len,
         )
     
-    def process_file(self, file_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    def process_file(self, file_path: str, file_obj: Optional[BinaryIO] = None, document_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """
         Process a file and return text chunks with metadata.
         
         Args:
             file_path: Path to the file to process
+            file_obj: Optional seekable file-like object to read instead of file_path
+            document_id: Optional ID to assign to the document, generated if omitted
             
         Returns:
             Tuple containing:
@@ -33,72 +85,129 @@ class DocumentProcessor:
         file_ext = os.path.splitext(file_path)[1].lower()
         
         if file_ext == '.pdf':
-            return self.process_pdf(file_path)
+            return self.process_pdf(file_path, file_obj, document_id)
         elif file_ext == '.csv':
-            return self.process_csv(file_path)
+            return self.process_csv(file_path, file_obj, document_id)
         else:
             raise ValueError(f"Unsupported file type: {file_ext}")
     
-    def process_pdf(self, pdf_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    def stream_file(self, file_path: str, file_obj: Optional[BinaryIO] = None, document_id: Optional[str] = None) -> Tuple[Iterator[Dict[str, Any]], Dict[str, Any]]:
         """
-        Extract text from a PDF file and split it into chunks.
+        Like process_file, but PDF chunks are produced lazily while pages are extracted,
+        so callers can start embedding before the whole document has been read.
         
         Args:
-            pdf_path: Path to the PDF file
+            file_path: Path to the file to process
+            file_obj: Optional seekable file-like object to read instead of file_path
+            document_id: Optional ID to assign to the document, generated if omitted
             
         Returns:
             Tuple containing:
-            - List of chunk dictionaries with text and metadata
+            - Iterator of chunk dictionaries with text and metadata
             - Document metadata
         """
-        # Extract text from PDF
-        text = ""
+        file_ext = os.path.splitext(file_path)[1].lower()
+        
+        if file_ext == '.pdf':
+            source, metadata = self._open_pdf(file_path, file_obj, document_id)
+            return self._iter_chunks(self._iter_pdf_text(source, metadata["pages"]), metadata), metadata
+        
+        chunks, metadata = self.process_file(file_path, file_obj, document_id)
+        return iter(chunks), metadata
+    
+    def _open_pdf(self, pdf_path: str, file_obj: Optional[BinaryIO], document_id: Optional[str]) -> Tuple[Union[str, bytes], Dict[str, Any]]:
+        """Read PDF metadata and return the source that page extraction should reopen."""
         metadata = {
             "source": os.path.basename(pdf_path),
             "type": "pdf",
-            "id": str(uuid.uuid4()),
+            "id": document_id or str(uuid.uuid4()),
             "uploadTime": str(pd.Timestamp.now())
         }
         
         try:
-            pdf_reader = PdfReader(pdf_path)
-            metadata["title"] = pdf_reader.metadata.title if pdf_reader.metadata and pdf_reader.metadata.title else "Untitled"
-            metadata["author"] = pdf_reader.metadata.author if pdf_reader.metadata and pdf_reader.metadata.author else "Unknown"
-            metadata["pages"] = len(pdf_reader.pages)
-            
-            # Extract text from each page
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
+            # Worker processes reopen the PDF, so hand them a path or raw bytes
+            source = file_obj.read() if file_obj is not None else pdf_path
+            with _pdfium_lock:
+                pdf = pdfium.PdfDocument(source)
+                try:
+                    pdf_metadata = pdf.get_metadata_dict(skip_empty=True)
+                    num_pages = len(pdf)
+                finally:
+                    pdf.close()
+        except Exception as e:
+            raise ValueError(f"Error processing PDF: {str(e)}")
+        
+        metadata["title"] = pdf_metadata.get("Title") or "Untitled"
+        metadata["author"] = pdf_metadata.get("Author") or "Unknown"
+        metadata["pages"] = num_pages
+        return source, metadata
+    
+    def _iter_pdf_text(self, source: Union[str, bytes], num_pages: int) -> Iterator[str]:
+        """Yield the text of each non-empty page with its page delimiter."""
+        try:
+            for page_num, page_text in enumerate(_iter_pages(source, num_pages)):
                 if page_text:
-                    text += f"\n\n--- Page {page_num + 1} ---\n\n{page_text}"
+                    yield f"\n\n--- Page {page_num + 1} ---\n\n{page_text}"
         except Exception as e:
             raise ValueError(f"Error processing PDF: {str(e)}")
+    
+    def _iter_chunks(self, texts: Iterable[str], metadata: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Split consecutive text segments into chunk dictionaries. Only the trailing,
+        possibly incomplete chunk is carried into the next segment, so memory stays
+        bounded by one segment rather than the whole document.
+        """
+        tail = ""
+        index = 0
+        for text in texts:
+            pieces = self.text_splitter.split_text(tail + text)
+            if not pieces:
+                continue
+            *complete, tail = pieces
+            for piece in complete:
+                yield self._make_chunk(piece, index, metadata)
+                index += 1
+        if tail:
+            yield self._make_chunk(tail, index, metadata)
+    
+    def _make_chunk(self, text: str, index: int, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the chunk dictionary indexed in Azure AI Search."""
+        return {
+            "id": f"{metadata['id']}_chunk_{index}",
+            "text": text,
+            "metadata": {
+                "source": metadata["source"],
+                "type": metadata["type"],
+                "document_id": metadata["id"],
+                "chunk_index": index
+            }
+        }
+    
+    def process_pdf(self, pdf_path: str, file_obj: Optional[BinaryIO] = None, document_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Extract text from a PDF file and split it into chunks.
         
-        # Split text into chunks
-        chunks = self.text_splitter.create_documents([text])
-        
-        # Convert to list of dictionaries with metadata
-        result = []
-        for i, chunk in enumerate(chunks):
-            result.append({
-                "id": f"{metadata['id']}_chunk_{i}",
-                "text": chunk.page_content,
-                "metadata": {
-                    "source": metadata["source"],
-                    "type": metadata["type"],
-                    "document_id": metadata["id"],
-                    "chunk_index": i
-                }
-            })
-        
-        return result, metadata
+        Args:
+            pdf_path: Path to the PDF file
+            file_obj: Optional seekable file-like object to read instead of pdf_path
+            document_id: Optional ID to assign to the document, generated if omitted
+            
+        Returns:
+            Tuple containing:
+            - List of chunk dictionaries with text and metadata
+            - Document metadata
+        """
+        source, metadata = self._open_pdf(pdf_path, file_obj, document_id)
+        return list(self._iter_chunks(self._iter_pdf_text(source, metadata["pages"]), metadata)), metadata
     
-    def process_csv(self, csv_path: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    def process_csv(self, csv_path: str, file_obj: Optional[BinaryIO] = None, document_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """
         Process a CSV file and convert it to text chunks.
         
         Args:
             csv_path: Path to the CSV file
+            file_obj: Optional seekable file-like object to read instead of csv_path
+            document_id: Optional ID to assign to the document, generated if omitted
             
         Returns:
             Tuple containing:
@@ -108,64 +217,53 @@ class DocumentProcessor:
         metadata = {
             "source": os.path.basename(csv_path),
             "type": "csv",
-            "id": str(uuid.uuid4()),
+            "id": document_id or str(uuid.uuid4()),
             "uploadTime": str(pd.Timestamp.now())
         }
         
         try:
             # Read CSV file
-            df = pd.read_csv(csv_path)
+            df = pd.read_csv(file_obj if file_obj is not None else csv_path)
             metadata["rows"] = len(df)
             metadata["columns"] = list(df.columns)
             
             # Convert CSV to text representation
-            text = f"CSV File: {os.path.basename(csv_path)}\n\n"
+            parts = [
+                f"CSV File: {os.path.basename(csv_path)}\n\n",
+                # Add column descriptions
+                "Columns: " + ", ".join(map(str, df.columns)) + "\n\n",
+            ]
             
-            # Add column descriptions
-            text += "Columns: " + ", ".join(df.columns) + "\n\n"
-            
-            # Convert each row to text
-            rows_text = ""
-            for index, row in df.iterrows():
-                rows_text += f"Row {index + 1}:\n"
-                for column in df.columns:
-                    rows_text += f"  {column}: {row[column]}\n"
-                rows_text += "\n"
+            # Convert each row to text, building whole columns at once instead of iterating rows
+            rows = "Row " + pd.Series(df.index + 1, index=df.index).astype(str) + ":\n"
+            for column in df.columns:
+                # map(str) renders every cell, missing ones included, as an f-string would
+                rows += f"  {column}: " + df[column].map(str) + "\n"
+            rows_text = "".join(rows + "\n")
             
             # Add summary statistics for numerical columns
-            text += "Summary Statistics:\n"
+            parts.append("Summary Statistics:\n")
             for column in df.columns:
                 if pd.api.types.is_numeric_dtype(df[column]):
-                    text += f"  {column}:\n"
-                    text += f"    Mean: {df[column].mean()}\n"
-                    text += f"    Min: {df[column].min()}\n"
-                    text += f"    Max: {df[column].max()}\n"
-                    text += f"    Median: {df[column].median()}\n\n"
+                    # Per column, so min and max keep the column's dtype (integers stay integers)
+                    values = df[column]
+                    parts.append(
+                        f"  {column}:\n"
+                        f"    Mean: {values.mean()}\n"
+                        f"    Min: {values.min()}\n"
+                        f"    Max: {values.max()}\n"
+                        f"    Median: {values.median()}\n\n"
+                    )
             
             # Add the rows text
-            text += "\nData Rows:\n" + rows_text
+            parts.append("\nData Rows:\n" + rows_text)
+            text = "".join(parts)
             
         except Exception as e:
             raise ValueError(f"Error processing CSV: {str(e)}")
         
         # Split text into chunks
-        chunks = self.text_splitter.create_documents([text])
-        
-        # Convert to list of dictionaries with metadata
-        result = []
-        for i, chunk in enumerate(chunks):
-            result.append({
-                "id": f"{metadata['id']}_chunk_{i}",
-                "text": chunk.page_content,
-                "metadata": {
-                    "source": metadata["source"],
-                    "type": metadata["type"],
-                    "document_id": metadata["id"],
-                    "chunk_index": i
-                }
-            })
-        
-        return result, metadata
+        return list(self._iter_chunks([text], metadata)), metadata
     
     def summarize_document(self, chunks: List[Dict[str, Any]], metadata: Dict[str, Any]) -> str:
         """
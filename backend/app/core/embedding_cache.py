@@ -0,0 +1,61 @@
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+from beanie import Document
+from pydantic import Field
+from bson import Binary
+from pymongo import UpdateOne
+from app.config import settings
+
+class EmbeddingCacheEntry(Document):
+    """Model for a chunk embedding persisted by content hash, independent of the search index."""
+    id: str = Field(...)  # "{embedding deployment}:{content hash}"
+    vector: bytes = Field(...)  # float16 values, half the size of a BSON array of doubles
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "embedding_cache"
+
+def _decode_vector(vector: Union[bytes, List[float]]) -> List[float]:
+    """Decode a stored vector, accepting entries written before vectors were packed as float16."""
+    if isinstance(vector, bytes):
+        return np.frombuffer(vector, dtype=np.float16).tolist()
+    return vector
+
+def embedding_cache_key(chunk_hash: str) -> str:
+    """Build a cache key scoped to the embedding deployment, so switching models invalidates it."""
+    return f"{settings.AZURE_OPENAI_EMBEDDING_DEPLOYMENT}:{chunk_hash}"
+
+async def get_cached_embeddings(chunk_hashes: List[str]) -> List[Optional[List[float]]]:
+    """Fetch cached vectors for the given content hashes, returning None where none is cached."""
+    keys = [embedding_cache_key(chunk_hash) for chunk_hash in chunk_hashes]
+    if not keys:
+        return []
+    # One round trip for the whole batch, served by the _id index; only the vector is returned
+    cursor = EmbeddingCacheEntry.get_motor_collection().find(
+        {"_id": {"$in": list(dict.fromkeys(keys))}},
+        {"vector": 1},
+    )
+    vectors_by_key: Dict[str, List[float]] = {
+        entry["_id"]: _decode_vector(entry["vector"]) async for entry in cursor
+    }
+    return [vectors_by_key.get(key) for key in keys]
+
+async def store_embeddings(vectors_by_hash: Dict[str, List[float]]) -> None:
+    """Persist newly computed vectors, ignoring entries another upload already cached."""
+    if not vectors_by_hash:
+        return
+    now = datetime.utcnow()
+    # Upserts with $setOnInsert keep the first vector written and never fail on concurrent duplicates
+    operations = [
+        UpdateOne(
+            {"_id": embedding_cache_key(chunk_hash)},
+            {"$setOnInsert": {
+                "vector": Binary(np.asarray(vector, dtype=np.float16).tobytes()),
+                "created_at": now,
+            }},
+            upsert=True,
+        )
+        for chunk_hash, vector in vectors_by_hash.items()
+    ]
+    await EmbeddingCacheEntry.get_motor_collection().bulk_write(operations, ordered=False)
@@ -3,6 +3,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 from app.config import settings
 from app.api.models.chat import Chat, Message, SessionMetadata
+from app.api.models.document import DocumentRecord
+from app.core.embedding_cache import EmbeddingCacheEntry
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +17,7 @@ async def init_mongodb():
         # Initialize Beanie with the document models
         await init_beanie(
             database=client[settings.MONGODB_DB_NAME],
-            document_models=[Chat, Message, SessionMetadata]
+            document_models=[Chat, Message, SessionMetadata, DocumentRecord, EmbeddingCacheEntry]
         )
         
         logger.info(f"MongoDB initialized successfully - connected to database: {settings.MONGODB_DB_NAME}")
@@ -1,48 +1,197 @@
-from typing import Any, Dict, List, Tuple, Optional
-from langchain.prompts import PromptTemplate
+import asyncio
+import hashlib
+import re
+import heapq
+import threading
+import textwrap
+import time
+import httpx
+import numpy as np
+from typing import Any, AsyncIterator, Dict, Iterable, List, NamedTuple, Tuple, Optional
 from langchain_openai import AzureChatOpenAI
-from langchain.memory import ConversationBufferMemory
 from app.config import settings
-from app.core.azure_search import AzureSearchService
+from app.core.azure_search import AzureSearchService, cosine_similarities, reciprocal_rank_fusion
 from .summarizer import MapReduceSummarizer
 from app.core.qa_graph import QAGraphRunner
+from app.utils.helpers import LRUCache
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Messages that are only conversational; answering them needs no document retrieval
+SMALL_TALK_RE = re.compile(
+    r"(?:hi|hello|hey|thanks|thank you|thx|ok|okay|bye|goodbye|who are you)(?: there)?[\s!.?]*",
+    re.IGNORECASE,
+)
+
+class CachedAnswer(NamedTuple):
+    """An answer remembered by the QA answer cache."""
+    index_version: int
+    scope: str  # document_id, or "" for questions across all documents
+    embedding: Optional[np.ndarray]  # float16 question embedding, for semantic lookups
+    answer: str
+    sources: List[Dict[str, Any]]
+    expires_at: float  # time.monotonic() deadline
+
 class QAService:
-    def __init__(self):
-        self.search_service = AzureSearchService()
+    def __init__(self, search_service: Optional[AzureSearchService] = None):
+        if search_service is None:
+            # Imported here because app.dependencies imports this module
+            from app.dependencies import get_azure_search_service
+            search_service = get_azure_search_service()
+        self.search_service = search_service
         self.llm = AzureChatOpenAI(
             deployment_name=settings.AZURE_OPENAI_CHAT_DEPLOYMENT,
             openai_api_key=settings.AZURE_OPENAI_API_KEY,
             azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
             openai_api_version=settings.AZURE_OPENAI_API_VERSION,
             temperature=0.3,
-        )
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", 
-            return_messages=True,
-            output_key="answer"
+            # One pooled async client, so concurrent questions reuse keep-alive connections
+            http_async_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            )),
         )
         self._setup_qa_chain()
-        self.summarizer = MapReduceSummarizer(llm=self.llm, token_max=4000)
+        self.qa_graph = QAGraphRunner(
+            system_prompt=self.qa_system_prompt,
+            prompt_template=self.qa_prompt,
+            llm=self.llm,
+            create_context_fn=self.create_context,
+            use_graph=settings.QA_USE_GRAPH
+        )
+        self.summarizer = MapReduceSummarizer(
+            llm=self.llm,
+            token_max=4000,
+            max_concurrency=settings.AZURE_OPENAI_MAX_CONCURRENCY,
+            model_name=settings.AZURE_OPENAI_CHAT_DEPLOYMENT
+        )
+
+        # Exact answers keyed by question, scope and history; semantic entries also carry
+        # the question embedding and are only kept for history-free questions
+        self._answer_cache = LRUCache(maxsize=settings.ANSWER_CACHE_SIZE)
+        self._semantic_answer_cache = LRUCache(maxsize=settings.SEMANTIC_CACHE_SIZE)
+        self._answer_cache_lock = threading.Lock()
+
+        # Map-reduce summaries by document_id; a document's chunks never change once indexed
+        self._summary_cache = LRUCache(maxsize=settings.SUMMARY_CACHE_SIZE)
+
+    def _answer_cache_key(self, question: str, document_id: Optional[str], chat_history: Optional[str]) -> bytes:
+        """Digest everything an answer depends on, including the current index version."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (str(self.search_service.index_version), document_id or "", chat_history or "", question.strip()):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.digest()
+
+    async def _get_cached_answer(
+        self, question: str, document_id: Optional[str], chat_history: Optional[str]
+    ) -> Tuple[Optional[Tuple[str, List[Dict[str, Any]]]], Optional[List[float]]]:
+        """
+        Look up an earlier answer, first by exact key, then by question similarity when
+        there is no chat history. Returns the hit (or None) and the question embedding
+        computed for the semantic lookup, so a miss can be stored without re-embedding.
+        """
+        now = time.monotonic()
+        with self._answer_cache_lock:
+            cached = self._answer_cache.get(self._answer_cache_key(question, document_id, chat_history))
+        if cached is not None and cached.expires_at > now:
+            return (cached.answer, cached.sources), None
+        if chat_history:
+            return None, None
+
+        try:
+            embedding = await self.search_service.aembed_query(question.strip())
+        except Exception as e:
+            logger.warning("Skipping semantic answer cache: %s", e)
+            return None, None
+
+        scope = document_id or ""
+        with self._answer_cache_lock:
+            candidates = [
+                entry for entry in self._semantic_answer_cache.values()
+                if entry.index_version == self.search_service.index_version
+                and entry.scope == scope
+                and entry.expires_at > now
+            ]
+        if candidates:
+            scores = cosine_similarities(embedding, np.vstack([entry.embedding for entry in candidates]))
+            best = int(np.argmax(scores))
+            if scores[best] >= settings.SEMANTIC_CACHE_THRESHOLD:
+                logger.info("Semantic answer cache hit (similarity %.3f)", scores[best])
+                return (candidates[best].answer, candidates[best].sources), embedding
+        return None, embedding
+
+    def _store_cached_answer(
+        self,
+        question: str,
+        document_id: Optional[str],
+        chat_history: Optional[str],
+        embedding: Optional[List[float]],
+        answer: str,
+        sources: List[Dict[str, Any]],
+    ) -> None:
+        """Remember an answer under its exact key and, when embedded, for semantic lookups."""
+        key = self._answer_cache_key(question, document_id, chat_history)
+        entry = CachedAnswer(
+            index_version=self.search_service.index_version,
+            scope=document_id or "",
+            embedding=np.asarray(embedding, dtype=np.float16) if embedding is not None else None,
+            answer=answer,
+            sources=sources,
+            expires_at=time.monotonic() + settings.ANSWER_CACHE_TTL_SECONDS,
+        )
+        with self._answer_cache_lock:
+            self._answer_cache[key] = entry
+            if entry.embedding is not None:
+                self._semantic_answer_cache[key] = entry
+
+    def clear_answer_cache(self):
+        with self._answer_cache_lock:
+            self._answer_cache.clear()
+            self._semantic_answer_cache.clear()
+        self._summary_cache.clear()
+
+    def _pack_context(self, entries: Iterable[Tuple[str, str]]) -> str:
+        """
+        Join (source, content) pairs, best first, into a context of at most MAX_CONTEXT_TOKENS.
+        The chunk that crosses the budget is cut short and the rest are dropped.
+        """
+        budget = settings.MAX_CONTEXT_TOKENS
+        parts = []
+        for source, content in entries:
+            words = content.split()
+            tokens = len(words) * 1.3  # Rough token estimate
+            if tokens > budget:
+                if parts and budget < 50:
+                    break
+                content = " ".join(words[:int(budget / 1.3)])
+                parts.append(f"Document: {source}\nContent: {content}")
+                break
+            parts.append(f"Document: {source}\nContent: {content}")
+            budget -= tokens
+        return "\n\n".join(parts)
 
     def create_context(self, docs=None, question: Optional[str] = None):
         if docs and isinstance(docs[0], dict):
-            sorted_docs = sorted(docs, key=lambda x: x["score"], reverse=True)
-            top_n = 3
-            relevant_docs = sorted_docs[:top_n]
-            return "\n\n".join([
-                f"Document: {doc['metadata'].get('source', 'unknown')}\nContent: {doc['content']}"
-                for doc in relevant_docs
-            ])
+            # Only the best three are used, so select them without sorting every result
+            relevant_docs = heapq.nlargest(3, docs, key=lambda x: x["score"])
+            return self._pack_context(
+                (doc["metadata"].get("source", "unknown"), doc["content"]) for doc in relevant_docs
+            )
 
         elif docs and hasattr(docs[0], "page_content"):
-            return "\n\n".join([
-                f"Document: {doc.metadata.get('source', 'unknown')}\nContent: {doc.page_content}"
-                for doc in docs[:3]
-            ])
+            relevant_docs = docs[:3]
+            if settings.RERANK_CONTEXT and question and len(docs) > 3:
+                try:
+                    relevant_docs = [
+                        docs[i] for i in self.search_service.rerank(question, [doc.page_content for doc in docs], 3)
+                    ]
+                except Exception as e:
+                    logger.warning("Reranking failed, keeping retriever order: %s", e)
+            return self._pack_context(
+                (doc.metadata.get("source", "unknown"), doc.page_content) for doc in relevant_docs
+            )
 
         elif question:
             fallback_results = self.search_service.search_documents(query=question, top_k=3)
@@ -51,18 +200,9 @@ class QAService:
         return "No relevant documents found."
 
     def _setup_qa_chain(self):
-        qa_prompt_template = """
+        qa_system_prompt = """
         You are a helpful AI assistant specialized in answering questions about documents.
 
-        # Conversation History
-        {chat_history}
-
-        # Current Question
-        {question}
-
-        # Document Context
-        {context}
-
         Based on the provided context and conversation history, please answer the user's question.
 
         Follow these rules:
@@ -72,87 +212,264 @@ class QAService:
         4. If the question is unclear, ask for clarification
         5. Always cite your sources by mentioning which document the information comes from
         6. Focus only on answering the current question, don't provide unnecessary information
+        """
+        qa_prompt_template = """
+        # Conversation History
+        {chat_history}
+
+        # Document Context
+        {context}
+
+        # Current Question
+        {question}
 
         Your answer:
         """
-        self.qa_prompt = PromptTemplate(
-            template=qa_prompt_template,
-            input_variables=["chat_history", "question", "context"]
-        )
+        # The instructions never change, so they go first as their own system message and every
+        # request shares that prefix, which lets Azure OpenAI prompt caching reuse it.
+        # Both are plain strings, dedented once here so the indentation is not sent with every
+        # request; rendering them needs none of PromptTemplate's validation
+        self.qa_system_prompt = textwrap.dedent(qa_system_prompt).strip()
+        self.qa_prompt = textwrap.dedent(qa_prompt_template).strip() + "\n"
+
+        multi_query_prompt_template = """
+        Write {count} different search queries that together cover the information needed
+        to answer the question below. Return one query per line, with no numbering or other text.
+
+        Question: {question}
+        """
+        self.multi_query_prompt = textwrap.dedent(multi_query_prompt_template).strip()
+
+        small_talk_prompt_template = """
+        You are a helpful AI assistant that answers questions about the user's uploaded documents.
+        Reply briefly and politely to the user's message below.
 
-    def _inject_chat_history(self, chat_id: Optional[str] = None, history: Optional[str] = None):
+        {question}
+        """
+        self.small_talk_prompt = textwrap.dedent(small_talk_prompt_template).strip()
+
+    def _chat_history_window(self, chat_id: Optional[str] = None, history: Optional[str] = None) -> str:
+        """
+        Build the prompt's conversation history for one request. The history comes from the
+        chat's stored messages via Message.format_history, which already windows it to the
+        most recent whole messages that fit in MAX_HISTORY_TOKENS, so nothing is kept in process.
+        """
+        if not history:
+            return f"Referring to chat history {chat_id}" if chat_id else ""
+        return history
+
+    async def _lookup_and_retrieve(
+        self, question: str, document_id: Optional[str], chat_history: Optional[str], use_cache: bool
+    ) -> Tuple[Optional[Tuple[str, List[Dict[str, Any]]]], Optional[List[float]], List[Any]]:
+        """
+        Check the answer cache while retrieval runs in the background, so a miss does not
+        pay for the cache lookup's embeddings request and the search one after the other.
+        Returns the cached answer (or None), the question embedding, and the retrieved docs.
+        """
+        retriever = self.search_service.create_langchain_retriever(top_k=5, document_id=document_id)
+        retrieval = asyncio.create_task(self._retrieve(retriever, question))
         try:
-            self.memory.clear()
-            if history:
-                self.memory.chat_memory.add_user_message(history)
-            elif chat_id:
-                history_ref = f"Referring to chat history {chat_id}"
-                self.memory.chat_memory.add_user_message(history_ref)
-        except Exception as e:
-            logger.error(f"Error injecting chat history: {e}")
+            if use_cache:
+                cached, embedding = await self._get_cached_answer(question, document_id, chat_history)
+                if cached is not None:
+                    retrieval.cancel()
+                    return cached, embedding, []
+            else:
+                embedding = None
+            return None, embedding, await retrieval
+        except BaseException:
+            retrieval.cancel()
+            raise
 
-    def answer_question(self, question: str, chat_id: Optional[str] = None, chat_history: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
-        self._inject_chat_history(chat_id, chat_history)
-        chat_mem = self.memory.load_memory_variables({}).get("chat_history", "")
-        retriever = self.search_service.create_langchain_retriever(top_k=5)
+    async def _retrieve(self, retriever, question: str, top_k: int = 5) -> List[Any]:
+        """
+        Retrieve documents for a question. With MULTI_QUERY_RETRIEVAL, the LLM also writes
+        sub-queries; all queries are searched concurrently and fused with Reciprocal Rank Fusion.
+        """
+        if not settings.MULTI_QUERY_RETRIEVAL:
+            return await retriever.ainvoke(question)
 
-        graph_runner = QAGraphRunner(
-            question=question,
-            chat_history=chat_mem,
-            retriever=retriever,
-            prompt_template=self.qa_prompt,
-            llm=self.llm,
-            create_context_fn=self.create_context
+        # The original question is searched while the sub-queries are being written
+        original = asyncio.create_task(retriever.ainvoke(question))
+        try:
+            response = await self.llm.ainvoke(
+                self.multi_query_prompt.format_map({"count": settings.MULTI_QUERY_COUNT, "question": question})
+            )
+            sub_queries = [line.strip() for line in response.content.splitlines() if line.strip()]
+        except Exception as e:
+            logger.warning("Query rewriting failed, using the original question only: %s", e)
+            return await original
+
+        rankings = await asyncio.gather(
+            original,
+            *(retriever.ainvoke(sub_query) for sub_query in sub_queries[:settings.MULTI_QUERY_COUNT]),
+        )
+        return reciprocal_rank_fusion(
+            rankings, key=lambda doc: doc.metadata.get("id") or doc.page_content, top_n=top_k
         )
-        answer, docs = graph_runner.run_sync()
-        self.memory.save_context({"question": question}, {"answer": answer})
+
+    def _is_small_talk(self, question: str) -> bool:
+        return SMALL_TALK_RE.fullmatch(question.strip()) is not None
+
+    async def answer_question(self, question: str, chat_id: Optional[str] = None, chat_history: Optional[str] = None, use_cache: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+        if self._is_small_talk(question):
+            # Greetings and thanks skip search and the answer cache; one short LLM call answers them
+            response = await self.llm.ainvoke(self.small_talk_prompt.format_map({"question": question}))
+            return response.content, []
+
+        cached, embedding, docs = await self._lookup_and_retrieve(question, None, chat_history, use_cache)
+        if cached is not None:
+            return cached
+
+        chat_mem = self._chat_history_window(chat_id, chat_history)
+        answer, docs = await self.qa_graph.run(question, chat_mem, docs=docs)
         sources = [{"text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        self._store_cached_answer(question, None, chat_history, embedding, answer, sources)
         return answer, sources
 
-    def answer_document_question(self, question: str, document_id: str, chat_id: Optional[str] = None, chat_history: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
-        self._inject_chat_history(chat_id, chat_history)
-        chat_mem = self.memory.load_memory_variables({}).get("chat_history", "")
-        retriever = self.search_service.create_langchain_retriever(top_k=5, document_id=document_id)
+    async def answer_document_question(self, question: str, document_id: str, chat_id: Optional[str] = None, chat_history: Optional[str] = None, use_cache: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+        if self._is_small_talk(question):
+            response = await self.llm.ainvoke(self.small_talk_prompt.format_map({"question": question}))
+            return response.content, []
 
-        graph_runner = QAGraphRunner(
-            question=question,
-            chat_history=chat_mem,
-            retriever=retriever,
-            prompt_template=self.qa_prompt,
-            llm=self.llm,
-            create_context_fn=self.create_context
-        )
-        answer, docs = graph_runner.run_sync()
-        
-        print(f"Answer: {answer}")
-        print(f"Docs: {docs}")
+        cached, embedding, docs = await self._lookup_and_retrieve(question, document_id, chat_history, use_cache)
+        if cached is not None:
+            return cached
+
+        chat_mem = self._chat_history_window(chat_id, chat_history)
+        answer, docs = await self.qa_graph.run(question, chat_mem, docs=docs)
+        logger.debug("Answered document %s question with %d source documents", document_id, len(docs))
         if not docs:
-            logger.warning(f"No content found for document ID: {document_id}")
+            logger.warning("No content found for document ID: %s", document_id)
             return "Could not generate answer. No document content found.", []
         
-        self.memory.save_context({"question": question}, {"answer": answer})
         sources = [{"text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        self._store_cached_answer(question, document_id, chat_history, embedding, answer, sources)
         return answer, sources
 
-    def generate_summary(self, document_id: str) -> str:
+    async def answer_question_stream(self, question: str, chat_id: Optional[str] = None, chat_history: Optional[str] = None, document_id: Optional[str] = None, use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answer a question as a stream of events: the sources first, then answer tokens as
+        the model produces them, then a final "done" event.
+        """
+        if self._is_small_talk(question):
+            yield {"type": "sources", "sources": []}
+            async for chunk in self.llm.astream(self.small_talk_prompt.format_map({"question": question})):
+                if chunk.content:
+                    yield {"type": "token", "content": chunk.content}
+            yield {"type": "done"}
+            return
+
+        cached, embedding, docs = await self._lookup_and_retrieve(question, document_id, chat_history, use_cache)
+        if cached is not None:
+            answer, sources = cached
+            yield {"type": "sources", "sources": sources}
+            yield {"type": "token", "content": answer}
+            yield {"type": "done"}
+            return
+
+        chat_mem = self._chat_history_window(chat_id, chat_history)
+        sources = [{"text": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        yield {"type": "sources", "sources": sources}
+
+        if document_id and not docs:
+            logger.warning("No content found for document ID: %s", document_id)
+            yield {"type": "token", "content": "Could not generate answer. No document content found."}
+            yield {"type": "done"}
+            return
+
+        try:
+            # Reranking may call the embeddings API, so build the context off the event loop
+            context = await asyncio.to_thread(self.create_context, docs, question)
+        except Exception as e:
+            logger.warning("Failed to build context from docs: %s. Using fallback.", e)
+            context = await asyncio.to_thread(self.create_context, docs=None, question=question)
+
+        prompt = [
+            ("system", self.qa_system_prompt),
+            ("human", self.qa_prompt.format_map({"chat_history": chat_mem, "question": question, "context": context})),
+        ]
+        tokens = []
+        async for chunk in self.llm.astream(prompt):
+            if chunk.content:
+                tokens.append(chunk.content)
+                yield {"type": "token", "content": chunk.content}
+
+        answer = "".join(tokens)
+        self._store_cached_answer(question, document_id, chat_history, embedding, answer, sources)
+        yield {"type": "done"}
+
+    async def generate_summary(self, document_id: str) -> str:
+        cached = self._summary_cache.get(document_id)
+        if cached is not None:
+            return cached
+
         try:
             retriever = self.search_service.create_langchain_retriever(top_k=20, document_id=document_id)
-            docs = self._fetch_documents(retriever)
+            docs = await self._fetch_documents(retriever)
 
             if not docs:
-                logger.warning(f"No content found to summarize for document ID: {document_id}")
+                logger.warning("No content found to summarize for document ID: %s", document_id)
                 return "Could not generate summary. No document content found."
 
-            summary = self.summarizer.generate_summary(docs)
+            summary = await self.summarizer.generate_summary(docs)
+            # The summarizer reports its own failures as text, so only cache real summaries
+            if not summary.startswith("Could not generate summary"):
+                self._summary_cache[document_id] = summary
             return summary
 
         except Exception as e:
-            logger.error(f"Error generating summary for {document_id}: {e}")
+            logger.error("Error generating summary for %s: %s", document_id, e)
             return f"Could not generate summary due to an error: {str(e)}"
 
-    def _fetch_documents(self, retriever) -> List[Any]:
-        return retriever.invoke("summarize")
+    async def generate_summaries(self, document_ids: List[str]) -> Dict[str, str]:
+        """
+        Summarize several documents at once: chunks for every document are retrieved
+        concurrently, then the map-reduce runs are batched with bounded concurrency.
+        """
+        summaries: Dict[str, str] = {}
+        pending = []
+        for document_id in dict.fromkeys(document_ids):
+            cached = self._summary_cache.get(document_id)
+            if cached is not None:
+                summaries[document_id] = cached
+            else:
+                pending.append(document_id)
+        if not pending:
+            return summaries
+
+        fetched = await asyncio.gather(
+            *(
+                self._fetch_documents(self.search_service.create_langchain_retriever(top_k=20, document_id=document_id))
+                for document_id in pending
+            ),
+            return_exceptions=True,
+        )
+
+        to_summarize = []
+        for document_id, docs in zip(pending, fetched):
+            if isinstance(docs, Exception):
+                logger.error("Error generating summary for %s: %s", document_id, docs)
+                summaries[document_id] = f"Could not generate summary due to an error: {str(docs)}"
+            elif not docs:
+                logger.warning("No content found to summarize for document ID: %s", document_id)
+                summaries[document_id] = "Could not generate summary. No document content found."
+            else:
+                to_summarize.append((document_id, docs))
+
+        results = await self.summarizer.generate_summaries(
+            [docs for _, docs in to_summarize], max_concurrency=settings.SUMMARY_CONCURRENCY
+        )
+        for (document_id, _), summary in zip(to_summarize, results):
+            if not summary.startswith("Could not generate summary"):
+                self._summary_cache[document_id] = summary
+            summaries[document_id] = summary
+        return summaries
+
+    async def _fetch_documents(self, retriever) -> List[Any]:
+        return await retriever.ainvoke("summarize")
 
     def clear_memory(self):
-        self.memory.clear()
+        # Conversation history lives with the chat's messages; only the caches are held here
+        self.clear_answer_cache()
         logger.info("Memory cleared.")
@@ -1,81 +1,120 @@
+import asyncio
 from langgraph.graph import StateGraph, END
 from langchain_core.documents import Document
-from typing import List, Tuple, TypedDict, Callable, Any
+from typing import List, Optional, Tuple, TypedDict, Callable, Any
 import logging
 
 logger = logging.getLogger(__name__)
 
 class QAGraphRunner:
+    """
+    Retrieve -> build context -> LLM, run as plain awaited steps. With use_graph=True the
+    same steps run as a compiled LangGraph instead, for tracing and observability runs.
+    The retriever is passed per run, since it depends on top_k and the document filter;
+    callers that already retrieved pass the docs instead.
+    """
+
     def __init__(
         self,
-        question: str,
-        chat_history: str,
-        retriever: Any,
-        prompt_template: Any,
+        system_prompt: str,
+        prompt_template: str,
         llm: Any,
-        create_context_fn: Callable[[List[Document]], str]
+        create_context_fn: Callable[[List[Document], str], str],
+        use_graph: bool = False
     ):
-        self.question = question
-        self.chat_history = chat_history
-        self.retriever = retriever
+        self.system_prompt = system_prompt
         self.prompt_template = prompt_template
+        # Bound once; rendering the prompt is then a single format_map call
+        self._format_prompt = prompt_template.format_map
         self.llm = llm
         self.create_context = create_context_fn
+        self.graph = self._build_graph() if use_graph else None
 
     class QAState(TypedDict):
         question: str
         chat_history: str
-        docs: List[Document]
+        retriever: Any
+        docs: Optional[List[Document]]
         context: str
         answer: str
 
-    def run_sync(self) -> Tuple[str, List[Document]]:
+    async def _retrieve_docs(self, question: str, retriever: Any) -> List[Document]:
+        docs = await retriever.ainvoke(question)
+        logger.info("Retrieved %d docs from retriever.", len(docs))
+        return docs
+
+    async def _build_context(self, docs: List[Document], question: str) -> str:
+        try:
+            # Reranking may call the embeddings API, so build the context off the event loop
+            return await asyncio.to_thread(self.create_context, docs, question)
+        except Exception as e:
+            logger.warning("Failed to build context from docs: %s. Using fallback.", e)
+            # The fallback runs a synchronous vector search
+            return await asyncio.to_thread(self.create_context, docs=None, question=question)
+
+    async def _run_llm(self, question: str, chat_history: str, context: str) -> str:
+        result = await self.llm.ainvoke([
+            ("system", self.system_prompt),
+            ("human", self._format_prompt({
+                "chat_history": chat_history,
+                "question": question,
+                "context": context
+            })),
+        ])
+        return result.content
+
+    def _build_graph(self):
+        async def retrieve_docs(state: QAGraphRunner.QAState):
+            if state["docs"] is not None:
+                return {}
+            return {"docs": await self._retrieve_docs(state["question"], state["retriever"])}
+
+        async def build_context(state: QAGraphRunner.QAState):
+            return {"context": await self._build_context(state["docs"], state["question"])}
+
+        async def run_llm(state: QAGraphRunner.QAState):
+            return {"answer": await self._run_llm(state["question"], state["chat_history"], state["context"])}
+
+        graph = StateGraph(QAGraphRunner.QAState)
+        graph.add_node("retrieve_docs", retrieve_docs)
+        graph.add_node("build_context", build_context)
+        graph.add_node("run_llm", run_llm)
+
+        graph.add_edge("retrieve_docs", "build_context")
+        graph.add_edge("build_context", "run_llm")
+        graph.add_edge("run_llm", END)
+        graph.set_entry_point("retrieve_docs")
+
+        return graph.compile()
+
+    async def run(
+        self,
+        question: str,
+        chat_history: str,
+        retriever: Any = None,
+        docs: Optional[List[Document]] = None
+    ) -> Tuple[str, List[Document]]:
+        """Run retrieval (unless docs are given), context building and the LLM call without blocking the event loop."""
         try:
-            def retrieve_docs(state: QAGraphRunner.QAState):
-                docs = self.retriever.invoke(state["question"])
-                logger.info(f"Retrieved {len(docs)} docs from retriever.")
-                return {"docs": docs}
-
-            def build_context(state: QAGraphRunner.QAState):
-                try:
-                    context = self.create_context(state["docs"])
-                except Exception as e:
-                    logger.warning(f"Failed to build context from docs: {e}. Using fallback.")
-                    context = self.create_context(docs=None, question=state["question"])
-                return {"context": context}
-
-            def run_llm(state: QAGraphRunner.QAState):
-                inputs = {
-                    "chat_history": state["chat_history"],
-                    "question": state["question"],
-                    "context": state["context"]
-                }
-                result = self.llm.invoke(self.prompt_template.format(**inputs))
-                return {"answer": result.content}
-
-            graph = StateGraph(QAGraphRunner.QAState)
-            graph.add_node("retrieve_docs", retrieve_docs)
-            graph.add_node("build_context", build_context)
-            graph.add_node("run_llm", run_llm)
-
-            graph.add_edge("retrieve_docs", "build_context")
-            graph.add_edge("build_context", "run_llm")
-            graph.add_edge("run_llm", END)
-            graph.set_entry_point("retrieve_docs")
-
-            app = graph.compile()
+            if self.graph is None:
+                if docs is None:
+                    docs = await self._retrieve_docs(question, retriever)
+                context = await self._build_context(docs, question)
+                answer = await self._run_llm(question, chat_history, context)
+                return answer, docs
 
             initial_state = {
-                "question": self.question,
-                "chat_history": self.chat_history,
-                "docs": [],
+                "question": question,
+                "chat_history": chat_history,
+                "retriever": retriever,
+                "docs": docs,
                 "context": "",
                 "answer": "",
             }
 
-            result = app.invoke(initial_state)
+            result = await self.graph.ainvoke(initial_state)
             return result["answer"], result["docs"]
 
         except Exception as e:
-            logger.error(f"QAGraph execution failed: {e}")
+            logger.error("QAGraph execution failed: %s", e)
             raise
@@ -1,9 +1,11 @@
-import os
+import hashlib
 import logging
+import threading
 import boto3
-import aioboto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from typing import BinaryIO, Union, Optional
+from typing import BinaryIO, ClassVar, Set
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -11,6 +13,10 @@ logger = logging.getLogger(__name__)
 class S3StorageService:
     """Service for handling document storage using Amazon S3."""
     
+    # Buckets verified in this process, shared by every instance
+    _checked_buckets: ClassVar[Set[str]] = set()
+    _checked_buckets_lock: ClassVar[threading.Lock] = threading.Lock()
+    
     def __init__(self):
         """Initialize the S3 storage service."""
         self.aws_access_key_id = settings.AWS_ACCESS_KEY_ID
@@ -19,23 +25,46 @@ class S3StorageService:
         self.bucket_name = settings.S3_BUCKET_NAME
         self.prefix = settings.S3_PREFIX
         
+        # A pool sized for concurrent transfers keeps connections (and their TLS sessions) alive
+        # for reuse; adaptive retries back off when S3 throttles instead of failing the request
+        self._boto_config = Config(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            retries={'mode': 'adaptive', 'max_attempts': 5},
+            tcp_keepalive=True,
+            s3={'addressing_style': 'virtual'},
+        )
+        
+        # Large files move as concurrent 8 MiB parts, streamed straight between S3 and the file
+        self._transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=16,
+            use_threads=True,
+            io_chunksize=1024 * 1024,
+        )
+        
         # Initialize S3 client
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=self.aws_access_key_id,
             aws_secret_access_key=self.aws_secret_access_key,
-            region_name=self.region_name
+            region_name=self.region_name,
+            config=self._boto_config
         )
         
-        # Create S3 session for async operations
-        self.s3_session = aioboto3.Session(
-            aws_access_key_id=self.aws_access_key_id,
-            aws_secret_access_key=self.aws_secret_access_key,
-            region_name=self.region_name
-        )
+        # Reused by every transfer, so its worker threads are not recreated per upload or download
+        self._transfer_manager = create_transfer_manager(self.s3_client, self._transfer_config)
         
-        # Ensure bucket exists
-        self._ensure_bucket_exists()
+        # Ensure bucket exists, once per process
+        if self.bucket_name not in self._checked_buckets:
+            with self._checked_buckets_lock:
+                if self.bucket_name not in self._checked_buckets:
+                    self._ensure_bucket_exists()
+                    self._checked_buckets.add(self.bucket_name)
+    
+    def shutdown(self) -> None:
+        """Stop the transfer workers, waiting for transfers in progress."""
+        self._transfer_manager.shutdown()
     
     def _ensure_bucket_exists(self):
         """Ensure the S3 bucket exists, creating it if it doesn't."""
@@ -65,7 +94,8 @@ class S3StorageService:
     
     def get_s3_key(self, filename: str) -> str:
         """
-        Generate an S3 key for a file.
+        Generate an S3 key for a file. A short hash of the filename spreads objects over
+        4096 sub-prefixes, since S3 request rates are limited per prefix.
         
         Args:
             filename: The filename
@@ -73,33 +103,8 @@ class S3StorageService:
         Returns:
             S3 key
         """
-        return f"{self.prefix}{filename}"
-    
-    def upload_file(self, file_path: str, s3_key: Optional[str] = None) -> str:
-        """
-        Upload a file to S3.
-        
-        Args:
-            file_path: Path to the local file
-            s3_key: Optional S3 key, if not provided will use filename
-            
-        Returns:
-            S3 key of the uploaded file
-        """
-        if not s3_key:
-            s3_key = self.get_s3_key(os.path.basename(file_path))
-        
-        try:
-            self.s3_client.upload_file(
-                Filename=file_path,
-                Bucket=self.bucket_name,
-                Key=s3_key
-            )
-            logger.info(f"Uploaded file {file_path} to S3 as {s3_key}")
-            return s3_key
-        except ClientError as e:
-            logger.error(f"Error uploading file to S3: {str(e)}")
-            raise
+        fanout = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:3]
+        return f"{self.prefix}{fanout}/{filename}"
     
     def upload_fileobj(self, fileobj: BinaryIO, s3_key: str) -> str:
         """
@@ -113,11 +118,7 @@ class S3StorageService:
             S3 key of the uploaded file
         """
         try:
-            self.s3_client.upload_fileobj(
-                Fileobj=fileobj,
-                Bucket=self.bucket_name,
-                Key=s3_key
-            )
+            self._transfer_manager.upload(fileobj, self.bucket_name, s3_key).result()
             logger.info(f"Uploaded file object to S3 as {s3_key}")
             return s3_key
         except ClientError as e:
@@ -136,60 +137,15 @@ class S3StorageService:
             Local file path
         """
         try:
-            self.s3_client.download_file(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Filename=file_path
-            )
+            # Parts are written straight into the destination file, with no temporary file and rename
+            with open(file_path, 'wb') as fileobj:
+                self._transfer_manager.download(self.bucket_name, s3_key, fileobj).result()
             logger.info(f"Downloaded file from S3 {s3_key} to {file_path}")
             return file_path
         except ClientError as e:
             logger.error(f"Error downloading file from S3: {str(e)}")
             raise
     
-    def get_file_content(self, s3_key: str) -> bytes:
-        """
-        Get the content of a file from S3.
-        
-        Args:
-            s3_key: S3 key of the file
-            
-        Returns:
-            File content as bytes
-        """
-        try:
-            response = self.s3_client.get_object(
-                Bucket=self.bucket_name,
-                Key=s3_key
-            )
-            return response['Body'].read()
-        except ClientError as e:
-            logger.error(f"Error getting file content from S3: {str(e)}")
-            raise
-    
-    async def get_file_content_async(self, s3_key: str) -> bytes:
-        """
-        Get the content of a file from S3 asynchronously.
-        
-        Args:
-            s3_key: S3 key of the file
-            
-        Returns:
-            File content as bytes
-        """
-        try:
-            async with self.s3_session.client('s3') as s3:
-                response = await s3.get_object(
-                    Bucket=self.bucket_name,
-                    Key=s3_key
-                )
-                async with response['Body'] as stream:
-                    content = await stream.read()
-                    return content
-        except ClientError as e:
-            logger.error(f"Error getting file content from S3 asynchronously: {str(e)}")
-            raise
-    
     def delete_file(self, s3_key: str) -> bool:
         """
         Delete a file from S3.
@@ -1,5 +1,9 @@
+import asyncio
 import operator
 import logging
+from functools import lru_cache
+
+import tiktoken
 from typing import Annotated, List, Literal, TypedDict, Any
 
 from langchain_core.output_parsers import StrOutputParser
@@ -11,10 +15,24 @@ from langchain.chains.combine_documents.reduce import (
     split_list_of_docs,
 )
 from langgraph.graph import END, START, StateGraph
-from langgraph.constants import Send
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str) -> tiktoken.Encoding:
+    """Tokenizer for a chat model, falling back to the GPT-4o family encoding for unknown names."""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+# Graph states
+class OverallState(TypedDict):
+    contents: List[str]
+    summaries: Annotated[list, operator.add]
+    collapsed_summaries: List[Document]
+    final_summary: str
+
 class MapReduceSummarizer:
     """
     Document summarizer using LangGraph's map-reduce pattern.
@@ -23,16 +41,23 @@ class MapReduceSummarizer:
     allowing for summarization of documents of any length.
     """
     
-    def __init__(self, llm: BaseChatModel, token_max: int = 4000):
+    def __init__(self, llm: BaseChatModel, token_max: int = 4000, max_concurrency: int = 10, model_name: str = "gpt-4o-mini"):
         """
         Initialize the summarizer.
         
         Args:
             llm: The language model to use for summarization
             token_max: Maximum tokens for each summarization step
+            max_concurrency: Maximum LLM calls in flight at once across all summaries
+            model_name: Chat model name, used to pick the tokenizer for token counts
         """
         self.llm = llm
         self.token_max = token_max
+        self.max_concurrency = max_concurrency
+        # Shared by every run, so concurrent summaries together stay under the limit. Created on
+        # first use: on Python 3.9 an asyncio primitive built in a worker thread has no event loop.
+        self._llm_slots = None
+        self._encoding = _get_encoding(model_name)
         
         # Define map and reduce prompts
         map_prompt = ChatPromptTemplate.from_messages([
@@ -50,44 +75,51 @@ class MapReduceSummarizer:
             ("human", reduce_template)
         ])
         self.reduce_chain = reduce_prompt | self.llm | StrOutputParser()
+        self.graph = self._build_graph()
+    
+    async def _ainvoke_limited(self, chain: Any, inputs: dict) -> str:
+        """Run one LLM chain call once a shared concurrency slot is free."""
+        if self._llm_slots is None:
+            self._llm_slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._llm_slots:
+            return await chain.ainvoke(inputs)
+    
+    def _token_counts(self, texts: List[str]) -> List[int]:
+        """Count tokens for several texts in one call; tiktoken encodes the batch in native threads."""
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(texts)]
     
     def _length_function(self, documents: List[Document]) -> int:
         """Get number of tokens for input contents."""
-        return sum(len(doc.page_content.split()) * 1.3 for doc in documents)  # Rough token estimate
+        return sum(self._token_counts([doc.page_content for doc in documents]))
     
-    async def generate_summary(self, documents: List[Document]) -> str:
+    def _pack_contents(self, contents: List[str]) -> List[str]:
         """
-        Generate a summary for a list of documents.
-        
-        Args:
-            documents: List of Document objects to summarize
-            
-        Returns:
-            A summarized string
+        Greedily pack consecutive chunks into sections of up to token_max // 2 tokens, so the
+        map step makes one LLM call per section instead of one per chunk.
         """
-        if not documents:
-            return "No documents provided for summarization."
-        
-        # Set up the graph states
-        class OverallState(TypedDict):
-            contents: List[str]
-            summaries: Annotated[list, operator.add]
-            collapsed_summaries: List[Document]
-            final_summary: str
-            
-        class SummaryState(TypedDict):
-            content: str
-        
+        budget = self.token_max // 2
+        packed: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        for content, tokens in zip(contents, self._token_counts(contents)):
+            if current and current_tokens + tokens > budget:
+                packed.append("\n\n---\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(content)
+            current_tokens += tokens
+        if current:
+            packed.append("\n\n---\n\n".join(current))
+        return packed
+    
+    def _build_graph(self):
+        """Compile the map-reduce graph once; every summary run reuses it."""
         # Graph node functions
-        async def generate_chunk_summary(state: SummaryState):
-            response = await self.map_chain.ainvoke({"context": state["content"]})
-            return {"summaries": [response]}
-            
-        def map_summaries(state: OverallState):
-            return [
-                Send("generate_chunk_summary", {"content": content}) 
-                for content in state["contents"]
-            ]
+        async def map_summaries(state: OverallState):
+            # Every section is summarized concurrently, bounded by the shared LLM slots
+            summaries = await asyncio.gather(
+                *(self._ainvoke_limited(self.map_chain, {"context": content}) for content in state["contents"])
+            )
+            return {"summaries": summaries}
             
         def collect_summaries(state: OverallState):
             return {
@@ -98,12 +130,12 @@ class MapReduceSummarizer:
             doc_lists = split_list_of_docs(
                 state["collapsed_summaries"], self._length_function, self.token_max
             )
-            results = []
-            for doc_list in doc_lists:
-                content = "\n".join([doc.page_content for doc in doc_list])
-                result = await self.reduce_chain.ainvoke({"docs": content})
-                results.append(Document(page_content=result))
-            return {"collapsed_summaries": results}
+            # Each group collapses independently, so reduce them all concurrently
+            results = await asyncio.gather(*(
+                self._ainvoke_limited(self.reduce_chain, {"docs": "\n".join(doc.page_content for doc in doc_list)})
+                for doc_list in doc_lists
+            ))
+            return {"collapsed_summaries": [Document(page_content=result) for result in results]}
             
         def should_collapse(state: OverallState) -> Literal["collapse_summaries", "generate_final_summary"]:
             num_tokens = self._length_function(state["collapsed_summaries"])
@@ -114,37 +146,80 @@ class MapReduceSummarizer:
             
         async def generate_final_summary(state: OverallState):
             content = "\n".join([doc.page_content for doc in state["collapsed_summaries"]])
-            response = await self.reduce_chain.ainvoke({"docs": content})
+            response = await self._ainvoke_limited(self.reduce_chain, {"docs": content})
             return {"final_summary": response}
         
-        try:
-            # Build the graph
-            graph = StateGraph(OverallState)
-            graph.add_node("generate_chunk_summary", generate_chunk_summary)
-            graph.add_node("collect_summaries", collect_summaries)
-            graph.add_node("collapse_summaries", collapse_summaries)
-            graph.add_node("generate_final_summary", generate_final_summary)
-            
-            # Add edges
-            graph.add_conditional_edges(START, map_summaries, ["generate_chunk_summary"])
-            graph.add_edge("generate_chunk_summary", "collect_summaries")
-            graph.add_conditional_edges("collect_summaries", should_collapse)
-            graph.add_conditional_edges("collapse_summaries", should_collapse)
-            graph.add_edge("generate_final_summary", END)
-            
-            app = graph.compile()
+        # Build the graph
+        graph = StateGraph(OverallState)
+        graph.add_node("map_summaries", map_summaries)
+        graph.add_node("collect_summaries", collect_summaries)
+        graph.add_node("collapse_summaries", collapse_summaries)
+        graph.add_node("generate_final_summary", generate_final_summary)
+        
+        # Add edges
+        graph.add_edge(START, "map_summaries")
+        graph.add_edge("map_summaries", "collect_summaries")
+        graph.add_conditional_edges("collect_summaries", should_collapse)
+        graph.add_conditional_edges("collapse_summaries", should_collapse)
+        graph.add_edge("generate_final_summary", END)
+        
+        return graph.compile()
+    
+    def _initial_state(self, documents: List[Document]) -> OverallState:
+        return {
+            "contents": self._pack_contents([doc.page_content for doc in documents]),
+            "summaries": [],
+            "collapsed_summaries": [],
+            "final_summary": ""
+        }
+    
+    async def generate_summary(self, documents: List[Document]) -> str:
+        """
+        Generate a summary for a list of documents.
+        
+        Args:
+            documents: List of Document objects to summarize
             
+        Returns:
+            A summarized string
+        """
+        if not documents:
+            return "No documents provided for summarization."
+        
+        try:
             # Run the graph
-            initial_state = {
-                "contents": [doc.page_content for doc in documents],
-                "summaries": [],
-                "collapsed_summaries": [],
-                "final_summary": ""
-            }
-            
-            result = await app.ainvoke(initial_state, {"recursion_limit": 10})
+            result = await self.graph.ainvoke(self._initial_state(documents), {"recursion_limit": 10})
             return result["final_summary"]
             
         except Exception as e:
-            logger.error(f"Error generating summary: {e}")
-            return f"Could not generate summary due to an error: {str(e)}"
\ No newline at end of file
+            logger.error("Error generating summary: %s", e)
+            return f"Could not generate summary due to an error: {str(e)}"
+    
+    async def generate_summaries(self, documents_list: List[List[Document]], max_concurrency: int = 8) -> List[str]:
+        """
+        Summarize several documents in one batch, running up to max_concurrency graphs at once.
+        
+        Args:
+            documents_list: One list of Document objects per document to summarize
+            max_concurrency: Maximum number of documents summarized concurrently
+            
+        Returns:
+            One summary per entry of documents_list, in the same order
+        """
+        summaries: List[str] = ["No documents provided for summarization."] * len(documents_list)
+        pending = [i for i, documents in enumerate(documents_list) if documents]
+        if not pending:
+            return summaries
+        
+        results = await self.graph.abatch(
+            [self._initial_state(documents_list[i]) for i in pending],
+            {"recursion_limit": 10, "max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        for i, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error("Error generating summary: %s", result)
+                summaries[i] = f"Could not generate summary due to an error: {str(result)}"
+            else:
+                summaries[i] = result["final_summary"]
+        return summaries
@@ -1,16 +1,28 @@
+from functools import lru_cache
+from typing import Optional
 from fastapi import Depends, HTTPException, status
+from app.config import settings
 from app.core.document_processor import DocumentProcessor
 from app.core.azure_search import AzureSearchService
 from app.core.qa_chain import QAService
+from app.core.s3_storage import S3StorageService
 
 # Dependency to get document processor
+@lru_cache(maxsize=1)
 def get_document_processor():
     return DocumentProcessor()
 
 # Dependency to get Azure search service
+@lru_cache(maxsize=1)
 def get_azure_search_service():
     return AzureSearchService()
 
 # Dependency to get QA service
+@lru_cache(maxsize=1)
 def get_qa_service():
-    return QAService()
\ No newline at end of file
+    return QAService(search_service=get_azure_search_service())
+
+# Dependency to get S3 storage service (None when S3 storage is disabled)
+@lru_cache(maxsize=1)
+def get_s3_storage_service() -> Optional[S3StorageService]:
+    return S3StorageService() if settings.USE_S3_STORAGE else None
\ No newline at end of file
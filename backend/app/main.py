@@ -1,25 +1,36 @@
+import asyncio
+import logging
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from app.config import settings
 from app.api.routes import documents, qa, chats
 from app.core.mongodb import init_mongodb
+from app.dependencies import get_azure_search_service, get_s3_storage_service
+
+logger = logging.getLogger(__name__)
 
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
     description=settings.APP_DESCRIPTION,
     version=settings.APP_VERSION,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware for frontend integration
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # In production, restrict this to your frontend domain
+    allow_origins=settings.CORS_ALLOW_ORIGINS,  # In production, restrict this to your frontend domain
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# Compress text-heavy answers and summaries
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE, compresslevel=5)
+
 # Include API routes
 app.include_router(documents.router, prefix="/api/documents", tags=["Documents"])
 app.include_router(qa.router, prefix="/api/qa", tags=["Question Answering"])
@@ -40,6 +51,21 @@ async def startup_db_client():
     """Initialize MongoDB connection on startup."""
     await init_mongodb()
 
+@app.on_event("startup")
+async def startup_search_index():
+    """Verify the Azure AI Search index once at boot instead of on the request path."""
+    try:
+        await asyncio.to_thread(get_azure_search_service().ensure_index)
+    except Exception as e:
+        # Uploads and searches retry the check, so chat routes can still start
+        logger.error(f"Failed to verify search index on startup: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_s3_transfers():
+    """Stop the S3 transfer workers, if the storage service was ever created."""
+    if settings.USE_S3_STORAGE and get_s3_storage_service.cache_info().currsize:
+        await asyncio.to_thread(get_s3_storage_service().shutdown)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
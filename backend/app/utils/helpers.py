@@ -2,9 +2,58 @@ import os
 import logging
 from typing import List, Dict, Any, Optional
 import json
+import orjson
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+class LRUCache:
+    """
+    Minimal least-recently-used cache with a fixed number of entries.
+    Not thread-safe; intended for state owned by the event loop.
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries kept before evicting the oldest
+        """
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Return the cached value for key, marking it as recently used."""
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        """Remove key from the cache and return its value."""
+        return self._data.pop(key, default)
+
+    def values(self) -> List[Any]:
+        """Return a snapshot of the cached values without changing their recency."""
+        return list(self._data.values())
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._data.clear()
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
 def ensure_directory_exists(directory_path: str) -> None:
     """
     Ensure that a directory exists, creating it if it doesn't.
@@ -12,9 +61,12 @@ def ensure_directory_exists(directory_path: str) -> None:
     Args:
         directory_path: Path to the directory to check/create
     """
-    if not os.path.exists(directory_path):
+    # Attempt the create directly: no separate stat, and no race if another worker creates it first
+    try:
         os.makedirs(directory_path)
-        logger.info(f"Created directory: {directory_path}")
+    except FileExistsError:
+        return
+    logger.info(f"Created directory: {directory_path}")
 
 def clean_text(text: str) -> str:
     """
@@ -26,11 +78,9 @@ def clean_text(text: str) -> str:
     Returns:
         Cleaned text
     """
-    # Replace multiple spaces with a single space
-    text = ' '.join(text.split())
-    # Replace multiple newlines with a single newline
-    text = '\n'.join([line for line in text.splitlines() if line.strip()])
-    return text
+    # Collapse every run of whitespace, newlines included, into a single space. This leaves
+    # no line breaks, so no separate pass over blank lines is needed
+    return ' '.join(text.split())
 
 def format_metadata_for_display(metadata: Dict[str, Any]) -> str:
     """
@@ -98,7 +148,9 @@ def safe_serialize_to_json(obj: Any) -> str:
         JSON string
     """
     try:
-        return json.dumps(obj, default=str)
+        return orjson.dumps(
+            obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode("utf-8")
     except Exception as e:
         logger.warning(f"Error serializing object to JSON: {str(e)}")
         return json.dumps(str(obj))
\ No newline at end of file
@@ -121,7 +121,7 @@ const FileUpload = ({ onUploadSuccess }) => {
       
       // Get IDs of processing documents
       const processingDocs = response.documents
-        .filter(doc => doc.status === "processing")
+        .filter(doc => doc.status === "queued" || doc.status === "processing")
         .map(doc => doc.id);
       
       if (processingDocs.length > 0) {